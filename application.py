@@ -1,8 +1,11 @@
+import multiprocessing
 import webbrowser
 
 from topicsexplorer import views
 
 
 if __name__ == "__main__":
+    # Topic models are fitted in child processes, also in the frozen app:
+    multiprocessing.freeze_support()
     webbrowser.open("http://localhost:5001/")
     views.web.run(port=5001)
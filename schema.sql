@@ -1,8 +1,15 @@
 DROP TABLE IF EXISTS textfiles;
+DROP TABLE IF EXISTS paragraphs;
 DROP TABLE IF EXISTS token_freqs;
 DROP TABLE IF EXISTS stopwords;
 DROP TABLE IF EXISTS parameters;
 DROP TABLE IF EXISTS model;
+DROP TABLE IF EXISTS vocabulary;
+DROP TABLE IF EXISTS topics;
+DROP TABLE IF EXISTS aggregates;
+DROP TABLE IF EXISTS diagnostics;
+DROP TABLE IF EXISTS metadata;
+DROP TABLE IF EXISTS groups;
 
 CREATE TABLE textfiles (
   id INTEGER PRIMARY KEY,
@@ -11,6 +18,15 @@ CREATE TABLE textfiles (
   size INTEGER
 );
 
+CREATE TABLE paragraphs (
+  id INTEGER PRIMARY KEY,
+  title TEXT,
+  position INTEGER,
+  content TEXT
+);
+
+CREATE INDEX paragraphs_position ON paragraphs (title, position);
+
 CREATE TABLE token_freqs (
   id INTEGER PRIMARY KEY,
   content TEXT
@@ -28,8 +44,55 @@ CREATE TABLE parameters (
 
 CREATE TABLE model (
   id INTEGER PRIMARY KEY,
-  document_topic TEXT,
-  topics TEXT,
-  document_similarities TEXT,
-  topic_similarities TEXT
-);
\ No newline at end of file
+  dtype TEXT,
+  titles TEXT,
+  document_topic BLOB,
+  document_similarities BLOB,
+  topic_similarities BLOB
+);
+
+CREATE TABLE vocabulary (
+  id INTEGER PRIMARY KEY,
+  word TEXT
+);
+
+CREATE TABLE topics (
+  id INTEGER PRIMARY KEY,
+  descriptor TEXT UNIQUE,
+  words BLOB,
+  weights BLOB
+);
+
+CREATE TABLE aggregates (
+  id INTEGER PRIMARY KEY,
+  name TEXT UNIQUE,
+  content TEXT
+);
+
+CREATE TABLE diagnostics (
+  topic INTEGER PRIMARY KEY,
+  umass REAL,
+  npmi REAL,
+  tokens INTEGER,
+  share REAL,
+  exclusivity REAL,
+  overlap REAL
+);
+
+CREATE TABLE metadata (
+  id INTEGER PRIMARY KEY,
+  title TEXT,
+  name TEXT,
+  value TEXT
+);
+
+CREATE TABLE groups (
+  id INTEGER PRIMARY KEY,
+  name TEXT,
+  value TEXT,
+  documents INTEGER,
+  tokens INTEGER,
+  weights BLOB
+);
+
+CREATE INDEX groups_name ON groups (name);
@@ -0,0 +1,86 @@
+from pathlib import Path
+import json
+import sys
+
+import flask
+import numpy as np
+
+sys.path.insert(0, str(Path(".").absolute()))
+
+from topicsexplorer import bundle
+from topicsexplorer import cli
+from topicsexplorer import database
+from topicsexplorer import utils
+
+from test_cli import create_corpus
+
+
+def select(topic, title):
+    return [
+        database.select("topics"),
+        database.select("topic_words", topic=topic, n=5),
+        database.select("textfile", title=title),
+        database.select("textfile_page", title=title, page=0),
+        database.select("parameters"),
+        database.select("aggregate", name="topic_proportions"),
+        database.select("diagnostics"),
+        json.loads(database.select("token_freqs")),
+        database.select("document_topic_distributions").to_dict(),
+        database.select("document_similarities").to_dict(),
+        database.select("document_topics", title=title),
+        database.select("topic_documents", topic=topic),
+        database.select("similar_documents", title=title),
+        database.select("similar_topics", topic=topic),
+    ]
+
+
+def test_bundle(tmp_path):
+    create_corpus(tmp_path)
+    # Pages of several paragraphs, some split, with multi-byte characters:
+    paragraph = " ".join(["grüße"] * 800 + ["straße"] * 800)
+    text = "\n\n".join([paragraph] * 3 + ["ende"] * 2)
+    Path(tmp_path, "document9.txt").write_text(text, encoding="utf-8")
+    directory = Path(tmp_path, "bundle")
+    argv = [
+        str(tmp_path),
+        "--topics=3",
+        "--iterations=10",
+        "--mfw=5",
+        "--database={}".format(Path(tmp_path, "topicsexplorer.db")),
+        "--checkpoint={}".format(Path(tmp_path, "checkpoint.npz")),
+        "--bundle={}".format(directory),
+        "--shard-size=4",
+    ]
+    assert cli.main(argv) == 0
+    manifest = json.loads(Path(directory, "manifest.json").read_text("utf-8"))
+    assert [shard["end"] for shard in manifest["shards"]] == [4, 8, 10]
+
+    app = utils.init_app("topicsexplorer")
+    with app.app_context():
+        flask.g.paths = {utils.DATABASE: Path(tmp_path, "topicsexplorer.db")}
+        topic = list(json.loads(database.select("topics")))[1]
+        title = manifest["shards"][2]["titles"][0]
+        expected = select(topic, title)
+        pages = [
+            database.select("textfile_page", title="document9", page=n)
+            for n in range(5)
+        ]
+        flask.g.bundle = str(directory)
+        selected = select(topic, title)
+        assert pages[0][1] == 4
+        for n, page in enumerate(pages):
+            assert database.select("textfile_page", title="document9", page=n) == page
+    assert selected[:8] == expected[:8]
+    for selected_matrix, expected_matrix in zip(selected[8:10], expected[8:10]):
+        assert selected_matrix.keys() == expected_matrix.keys()
+        for key in expected_matrix:
+            assert np.allclose(
+                list(selected_matrix[key].values()),
+                list(expected_matrix[key].values()),
+            )
+    # Rows and columns read on their own:
+    for selected_row, expected_row in zip(selected[10:], expected[10:]):
+        assert selected_row.keys() == expected_row.keys()
+        assert np.allclose(list(selected_row.values()), list(expected_row.values()))
+    shard = bundle.load(str(directory))["shards"][0]
+    assert isinstance(shard["document_similarities"], np.memmap)
@@ -0,0 +1,101 @@
+from pathlib import Path
+import json
+import sqlite3
+import sys
+
+import numpy as np
+
+sys.path.insert(0, str(Path(".").absolute()))
+
+from topicsexplorer import cli
+from topicsexplorer import utils
+
+
+def create_corpus(directory, n=10):
+    random_state = np.random.RandomState(0)
+    words = ["".join(random_state.choice(list("abcdefg"), 5)) for _ in range(50)]
+    for i in range(n):
+        text = " ".join(random_state.choice(words, 100))
+        Path(directory, "document{}.txt".format(i)).write_text(text, encoding="utf-8")
+
+
+def test_get_paths(tmp_path):
+    create_corpus(tmp_path, n=2)
+    Path(tmp_path, "ignored.pdf").touch()
+    expected = [Path(tmp_path, "document0.txt"), Path(tmp_path, "document1.txt")]
+    assert list(cli.get_paths([str(tmp_path)])) == expected
+    assert list(cli.get_paths([str(Path(tmp_path, "*.txt"))])) == expected
+
+
+def test_main(tmp_path):
+    create_corpus(tmp_path)
+    database = Path(tmp_path, "topicsexplorer.db")
+    argv = [
+        str(tmp_path),
+        "--topics=3",
+        "--iterations=10",
+        "--mfw=5",
+        "--dtype=float64",
+        "--database={}".format(database),
+        "--checkpoint={}".format(Path(tmp_path, "checkpoint.npz")),
+    ]
+    assert cli.main(argv) == 0
+    db = sqlite3.connect(str(database))
+    parameters = json.loads(db.execute("SELECT content FROM parameters;").fetchone()[0])
+    assert parameters["n_topics"] == 3
+    assert parameters["n_documents"] == 10
+    argv = ["--database={}".format(database), str(Path(tmp_path, "*.pdf"))]
+    assert cli.main(argv) == 1
+
+
+def test_main_metadata(tmp_path):
+    create_corpus(tmp_path)
+    for n, path in enumerate(sorted(tmp_path.glob("*.txt"))):
+        name = "author{}_{}_{}.txt".format(n % 2, n, 1900 + n % 3)
+        path.rename(Path(tmp_path, name))
+    database = Path(tmp_path, "topicsexplorer.db")
+    argv = [
+        str(tmp_path),
+        "--topics=3",
+        "--iterations=10",
+        "--mfw=5",
+        "--fields=author,-,year",
+        "--database={}".format(database),
+        "--checkpoint={}".format(Path(tmp_path, "checkpoint.npz")),
+    ]
+    assert cli.main(argv) == 0
+    db = sqlite3.connect(str(database))
+    groups = db.execute(
+        "SELECT name, value, documents, tokens, weights FROM groups ORDER BY id;"
+    ).fetchall()
+    assert [(name, value, n) for name, value, n, _, _ in groups] == [
+        ("author", "author0", 5),
+        ("author", "author1", 5),
+        ("year", "1900", 4),
+        ("year", "1901", 3),
+        ("year", "1902", 3),
+    ]
+    # The topic weights of a group add up to its tokens:
+    for _, _, _, tokens, weights in groups:
+        assert np.isclose(np.frombuffer(weights, dtype="<f4").sum(), tokens)
+
+
+def test_main_workspaces(tmp_path, monkeypatch):
+    monkeypatch.setattr(utils, "WORKSPACES", Path(tmp_path, "workspaces"))
+    corpus = Path(tmp_path, "corpus")
+    corpus.mkdir()
+    create_corpus(corpus)
+    argv = [str(corpus), "--topics=3", "--iterations=10", "--mfw=5"]
+    assert cli.main(argv) == 0
+    assert cli.main(argv) == 0
+    # Runs without explicit files do not share them:
+    workspaces = list(Path(tmp_path, "workspaces").iterdir())
+    assert len(workspaces) == 2
+    for workspace in workspaces:
+        assert Path(workspace, utils.DATABASE.name).exists()
+        assert Path(workspace, utils.CHECKPOINT.name).exists()
+    # With both files given, a run needs no workspace:
+    database = "--database={}".format(Path(tmp_path, "topicsexplorer.db"))
+    checkpoint = "--checkpoint={}".format(Path(tmp_path, "checkpoint.npz"))
+    assert cli.main(argv + [database, checkpoint]) == 0
+    assert len(list(Path(tmp_path, "workspaces").iterdir())) == 2
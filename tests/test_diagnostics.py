@@ -0,0 +1,48 @@
+from pathlib import Path
+import sys
+
+import numpy as np
+
+sys.path.insert(0, str(Path(".").absolute()))
+
+from topicsexplorer import diagnostics
+
+
+def test_get_cooccurrences(monkeypatch):
+    documents = np.array([0, 0, 1, 1, 1, 0, 2])
+    tokens = np.array([5, 7, 5, 7, 9, 5, 9])
+    occurrences = diagnostics.get_occurrences(documents, tokens, np.array([5, 7, 9]))
+    assert occurrences[0].tolist() == [0, 0, 1, 1, 1, 2]
+    assert occurrences[1].tolist() == [0, 1, 0, 1, 2, 2]
+    expected = [[2, 2, 1], [2, 2, 1], [1, 1, 2]]
+    assert diagnostics.get_cooccurrences(*occurrences, 3).tolist() == expected
+    # Blocks of a single document give the same counts:
+    monkeypatch.setattr(diagnostics, "BLOCK_SIZE", 1)
+    assert diagnostics.get_cooccurrences(*occurrences, 3).tolist() == expected
+
+
+def test_get_coherence():
+    cooccurrences = np.array([[2, 2, 0], [2, 2, 0], [0, 0, 2]])
+    local = np.array([[0, 1], [0, 2]])
+    umass, npmi = diagnostics.get_coherence(local, cooccurrences, 4)
+    assert np.allclose(umass, [np.log(3 / 2), np.log(1 / 2)])
+    assert np.allclose(npmi, [1, -1])
+
+
+def test_get_diagnostics():
+    class Model:
+        nz_ = np.array([3, 1])
+        ndz_ = np.zeros((3, 2))
+        topic_word_ = np.array([[0.6, 0.3, 0.1], [0.2, 0.2, 0.6]])
+
+    words = np.array([[0, 1, 2], [2, 0, 1]])
+    documents = np.array([0, 0, 1, 2])
+    tokens = np.array([0, 1, 2, 0])
+    result = diagnostics.get_diagnostics(Model, words, documents, tokens, n=2)
+    assert result["share"].tolist() == [0.75, 0.25]
+    assert np.allclose(
+        result["exclusivity"],
+        [(0.6 / 0.8 + 0.3 / 0.5) / 2, (0.6 / 0.7 + 0.2 / 0.8) / 2],
+    )
+    assert result["overlap"].tolist() == [0.5, 0.5]
+    assert result["umass"].shape == (2,)
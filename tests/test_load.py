@@ -0,0 +1,349 @@
+from pathlib import Path
+import argparse
+import json
+import logging
+import shutil
+import sys
+import threading
+import time
+import tracemalloc
+import types
+import urllib.error
+import urllib.parse
+import urllib.request
+import uuid
+
+import flask
+import numpy as np
+import werkzeug.serving
+
+sys.path.insert(0, str(Path(".").absolute()))
+
+from topicsexplorer import bundle
+from topicsexplorer import database
+from topicsexplorer import utils
+from topicsexplorer import views
+from topicsexplorer import workflow
+
+
+# Words per paragraph of the synthetic texts:
+PARAGRAPH = 100
+
+
+def create_model(name, documents=1000, topics=20, words=5000, size=500, seed=0):
+    """Write a synthetic topic model of the given size into a workspace."""
+    random_state = np.random.RandomState(seed)
+    vocabulary = ["w{:05d}".format(n) for n in range(words)]
+    titles = ["document-{:05d}".format(n) for n in range(documents)]
+    # Tokens are drawn like LDA assumes, a topic for each and a word of it:
+    topic_word = random_state.dirichlet([0.05] * words, size=topics)
+    document_topic = random_state.dirichlet([0.1] * topics, size=documents)
+    DS = np.repeat(np.arange(documents), size)
+    ZS = np.concatenate(
+        [random_state.choice(topics, size, p=p) for p in document_topic]
+    )
+    WS = np.zeros_like(ZS)
+    for topic in range(topics):
+        tokens = ZS == topic
+        WS[tokens] = random_state.choice(words, tokens.sum(), p=topic_word[topic])
+    ndz = np.zeros((documents, topics))
+    np.add.at(ndz, (DS, ZS), 1)
+    nzw = np.zeros((topics, words))
+    np.add.at(nzw, (ZS, WS), 1)
+    model = types.SimpleNamespace(
+        ndz_=ndz,
+        nz_=nzw.sum(axis=1),
+        doc_topic_=(ndz + 0.1) / (ndz + 0.1).sum(axis=1, keepdims=True),
+        topic_word_=(nzw + 0.01) / (nzw + 0.01).sum(axis=1, keepdims=True),
+    )
+    texts = (
+        "\n\n".join(
+            " ".join(row[start : start + PARAGRAPH])
+            for start in range(0, size, PARAGRAPH)
+        )
+        for row in np.array(vocabulary)[WS].reshape(documents, size)
+    )
+    parameters = {
+        "n_topics": topics,
+        "n_iterations": 0,
+        "random_state": seed,
+        "tolerance": 0.0,
+        "n_documents": documents,
+        "n_stopwords": 0,
+        "n_hapax": 0,
+        "n_tokens": documents * size,
+        "n_types": words,
+        "n_features": words,
+        "pruning": {},
+        "log_likelihood": 0,
+        "converged": False,
+        "log_likelihoods": [],
+    }
+
+    workspace = utils.get_workspace(name)
+    with views.web.app_context():
+        flask.g.workspace = workspace
+        utils.init_db(views.web)
+        database.insert_into("textfiles", zip(titles, texts))
+        database.update("textfiles", dict.fromkeys(titles, size))
+        database.insert_into(
+            "metadata",
+            [(title, "year", str(1900 + n % 10)) for n, title in enumerate(titles)],
+        )
+        database.insert_into("token_freqs", json.dumps([size] * documents))
+        database.insert_into("stopwords", json.dumps([]))
+        database.insert_into("parameters", json.dumps(parameters))
+        np.savez(str(utils.get_path(utils.CHECKPOINT)), DS=DS, WS=WS)
+        workflow.save_model_output(model, vocabulary, titles)
+    return workspace
+
+
+def create_bundle(workspace):
+    """Write the model of a workspace into a bundle and serve it."""
+    with views.web.app_context():
+        flask.g.workspace = workspace
+        utils.BUNDLE = str(bundle.write(Path(workspace, "bundle")))
+
+
+def get_endpoints(workspace):
+    """Pages and API endpoints to load, by name."""
+    with views.web.app_context():
+        flask.g.workspace = workspace
+        topic = database.select("topic_arrays")[0][0]
+        title = database.select("textfile_sizes")[0][0]
+    topic = urllib.parse.quote(topic, safe="")
+    title = urllib.parse.quote(title, safe="")
+    return {
+        "overview-topics": "/overview-topics",
+        "overview-documents": "/overview-documents",
+        "parameters": "/parameters",
+        "topics": "/topics/{}".format(topic),
+        "documents": "/documents/{}".format(title),
+        "api/topics": "/api/topics",
+        "api/topic-words": "/api/topics/{}".format(topic),
+        "api/textfile-page": "/api/textfiles/{}/pages/0".format(title),
+        "api/document-topic-distributions": "/api/document-topic-distributions",
+        "api/document-similarities": "/api/document-similarities",
+        "api/topic-similarities": "/api/topic-similarities",
+        "api/diagnostics": "/api/diagnostics",
+        "api/groups": "/api/groups/year",
+        "api/topic-map": "/api/topic-map",
+        "api/document-map": "/api/document-map",
+        "export": "/export/topicsexplorer-data.zip",
+    }
+
+
+def start_server():
+    """Serve the app from a local, threaded WSGI server."""
+    server = werkzeug.serving.make_server("127.0.0.1", 0, views.web, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def get_client(workspace, server=None):
+    """Get a function requesting a URL in the workspace, returning the status."""
+    if server is None:
+        client = views.web.test_client()
+        with client.session_transaction() as session:
+            session["workspace"] = workspace.name
+
+        def request(url):
+            response = client.get(url)
+            response.get_data()
+            response.close()
+            return response.status_code
+
+        return request
+
+    serializer = views.web.session_interface.get_signing_serializer(views.web)
+    cookie = "{}={}".format(
+        views.web.session_cookie_name, serializer.dumps({"workspace": workspace.name})
+    )
+    host = "http://127.0.0.1:{}".format(server.server_port)
+
+    def request(url):
+        request = urllib.request.Request(host + url, headers={"Cookie": cookie})
+        try:
+            with urllib.request.urlopen(request) as response:
+                response.read()
+                return response.status
+        except urllib.error.HTTPError as error:
+            return error.code
+
+    return request
+
+
+class ErrorCounter(logging.Handler):
+    """Count exceptions Flask logs, their error page is sent with status 200."""
+
+    def __init__(self):
+        super().__init__(logging.ERROR)
+        self.count = 0
+
+    def emit(self, record):
+        self.count += 1
+
+
+def measure(workspace, url, clients=4, requests=40, server=None):
+    """Request a URL from concurrent clients, return latencies and throughput."""
+    # Lazy imports and the first request are not part of the measurement:
+    get_client(workspace)(url)
+    # Peak of the memory allocated by Python and NumPy for a single request:
+    tracemalloc.start()
+    get_client(workspace)(url)
+    memory = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    latencies = []
+    statuses = []
+
+    def work(request, n):
+        for _ in range(n):
+            start = time.perf_counter()
+            statuses.append(request(url))
+            latencies.append(time.perf_counter() - start)
+
+    threads = [
+        threading.Thread(
+            target=work,
+            args=(
+                get_client(workspace, server),
+                requests // clients + (n < requests % clients),
+            ),
+        )
+        for n in range(clients)
+    ]
+    counter = ErrorCounter()
+    views.web.logger.addHandler(counter)
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    seconds = time.perf_counter() - start
+    views.web.logger.removeHandler(counter)
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+    return {
+        "requests": len(latencies),
+        "errors": sum(status >= 400 for status in statuses) + counter.count,
+        "p50": p50,
+        "p95": p95,
+        "p99": p99,
+        "throughput": len(latencies) / seconds,
+        "memory": memory,
+    }
+
+
+def run(workspace, endpoints, clients=4, requests=40, server=None):
+    """Load every endpoint in turn."""
+    return {
+        name: measure(workspace, url, clients, requests, server)
+        for name, url in endpoints.items()
+    }
+
+
+def report(results):
+    """Print a table of the results."""
+    print(
+        "{:<34} {:>8} {:>6} {:>9} {:>9} {:>9} {:>8} {:>9}".format(
+            "endpoint",
+            "requests",
+            "errors",
+            "p50 ms",
+            "p95 ms",
+            "p99 ms",
+            "req/s",
+            "peak MiB",
+        )
+    )
+    for name, result in results.items():
+        print(
+            "{:<34} {:>8} {:>6} {:>9.1f} {:>9.1f} {:>9.1f} {:>8.1f} {:>9.1f}".format(
+                name,
+                result["requests"],
+                result["errors"],
+                result["p50"] * 1000,
+                result["p95"] * 1000,
+                result["p99"] * 1000,
+                result["throughput"],
+                result["memory"] / 2 ** 20,
+            )
+        )
+
+
+def test_load(tmp_path, monkeypatch):
+    monkeypatch.setattr(utils, "WORKSPACES", tmp_path)
+    monkeypatch.setattr(utils, "BUNDLE", utils.BUNDLE)
+    workspace = create_model("load", documents=12, topics=3, words=100, size=50)
+    endpoints = get_endpoints(workspace)
+    results = run(workspace, endpoints, clients=2, requests=4)
+    assert list(results) == list(endpoints)
+    for result in results.values():
+        assert result["requests"] == 4
+        assert result["errors"] == 0
+        assert result["p50"] <= result["p95"] <= result["p99"]
+        assert result["memory"] > 0
+
+    # The same from a bundle, served by a local server:
+    create_bundle(workspace)
+    server = start_server()
+    try:
+        results = run(workspace, endpoints, clients=2, requests=2, server=server)
+    finally:
+        server.shutdown()
+    assert all(result["errors"] == 0 for result in results.values())
+
+
+def main(argv=None):
+    """Load test: python tests/test_load.py [options]"""
+    parser = argparse.ArgumentParser(
+        description="Load test the views and API endpoints with a synthetic model."
+    )
+    parser.add_argument("--documents", type=int, default=1000)
+    parser.add_argument("--topics", type=int, default=20)
+    parser.add_argument("--words", type=int, default=5000, help="vocabulary size")
+    parser.add_argument("--size", type=int, default=500, help="tokens per document")
+    parser.add_argument("--clients", type=int, default=4, help="concurrent clients")
+    parser.add_argument("--requests", type=int, default=40, help="per endpoint")
+    parser.add_argument("--server", action="store_true", help="use a local WSGI server")
+    parser.add_argument(
+        "--bundle", action="store_true", help="serve the model from a bundle"
+    )
+    parser.add_argument(
+        "--endpoint", action="append", help="only load this endpoint (repeatable)"
+    )
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    args = parser.parse_args(argv)
+
+    # Logging every query would dominate the latencies:
+    logging.basicConfig(level=logging.WARNING)
+    workspace = create_model(
+        "loadtest-{}".format(uuid.uuid4().hex),
+        args.documents,
+        args.topics,
+        args.words,
+        args.size,
+    )
+    server = None
+    try:
+        endpoints = get_endpoints(workspace)
+        if args.endpoint:
+            endpoints = {name: endpoints[name] for name in args.endpoint}
+        if args.bundle:
+            create_bundle(workspace)
+        if args.server:
+            server = start_server()
+        results = run(workspace, endpoints, args.clients, args.requests, server)
+    finally:
+        if server is not None:
+            server.shutdown()
+        shutil.rmtree(str(workspace), ignore_errors=True)
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        report(results)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,63 @@
+from pathlib import Path
+import sys
+
+import lda
+import numpy as np
+import pytest
+
+sys.path.insert(0, str(Path(".").absolute()))
+
+from topicsexplorer import sampling
+
+
+X = np.random.RandomState(0).randint(0, 5, size=(10, 30))
+VOCABULARY = ["word{}".format(n) for n in range(X.shape[1])]
+TITLES = ["document{}".format(n) for n in range(X.shape[0])]
+
+
+def test_fit(tmp_path):
+    checkpoint = Path(tmp_path, "checkpoint.npz")
+    model = lda.LDA(n_topics=3, n_iter=20, random_state=1)
+    model = sampling.fit(model, X, VOCABULARY, TITLES, checkpoint, every=5)
+    expected = lda.LDA(n_topics=3, n_iter=20, random_state=1).fit(X)
+    assert checkpoint.exists()
+    np.testing.assert_array_equal(model.nzw_, expected.nzw_)
+    np.testing.assert_array_equal(model.doc_topic_, expected.doc_topic_)
+
+
+def test_resume(tmp_path):
+    checkpoint = Path(tmp_path, "checkpoint.npz")
+    model = lda.LDA(n_topics=3, n_iter=10, random_state=1)
+    sampling.fit(model, X, VOCABULARY, TITLES, checkpoint, every=5)
+    model, vocabulary, titles = sampling.resume(checkpoint, iterations=10)
+    expected = lda.LDA(n_topics=3, n_iter=20, random_state=1).fit(X)
+    assert model.n_iter == 20
+    assert vocabulary == VOCABULARY
+    assert titles == TITLES
+    np.testing.assert_array_equal(model.nzw_, expected.nzw_)
+    np.testing.assert_array_equal(model.ndz_, expected.ndz_)
+    assert model.loglikelihoods_ == expected.loglikelihoods_
+
+
+def test_converged():
+    assert not sampling.converged([-100.0, -90.0], 0.01, window=1)
+    assert sampling.converged([-100.0, -90.0, -89.99], 0.01, window=1)
+    assert not sampling.converged([-100.0, -90.0, -89.99], 0, window=1)
+
+
+def test_fit_early_stopping():
+    model = lda.LDA(n_topics=3, n_iter=1000, random_state=1)
+    model = sampling.fit(model, X, VOCABULARY, TITLES, tolerance=0.01, window=2)
+    assert model.converged_ is not None
+    assert model.n_iter == model.converged_ + 1
+    assert model.n_iter < 1000
+
+
+def test_resume_other_model(tmp_path):
+    checkpoint = Path(tmp_path, "checkpoint.npz")
+    model = lda.LDA(n_topics=3, n_iter=10, random_state=1)
+    sampling.fit(model, X, VOCABULARY, TITLES, checkpoint, every=5)
+    with pytest.raises(ValueError):
+        sampling.resume(checkpoint, titles=TITLES[1:])
+    model, _, titles = sampling.resume(checkpoint, titles=TITLES[::-1])
+    assert titles == TITLES
@@ -0,0 +1,98 @@
+from pathlib import Path
+import os
+import sys
+import time
+
+sys.path.insert(0, str(Path(".").absolute()))
+
+from topicsexplorer import scheduler
+from topicsexplorer import utils
+
+
+def test_submit(tmp_path, monkeypatch):
+    monkeypatch.setattr(scheduler, "JOBS", Path(tmp_path, "jobs.db"))
+    # No free cores, jobs have to wait in the queue:
+    monkeypatch.setattr(scheduler, "MAX_JOBS", 0)
+    monkeypatch.setattr(scheduler, "start", lambda: None)
+    first = scheduler.submit(Path(tmp_path, "a"), "run", {"data": {}})
+    second = scheduler.submit(Path(tmp_path, "b"), "resume", {"iterations": 10})
+    assert first < second
+    job = scheduler.get_job(Path(tmp_path, "b"))
+    assert job["id"] == second
+    assert job["state"] == "queued"
+    assert job["position"] == 2
+    assert scheduler.get_job(Path(tmp_path, "c")) is None
+    # A workspace has one job at a time:
+    assert scheduler.submit(Path(tmp_path, "a"), "resume", {}) is None
+    assert scheduler.is_active(Path(tmp_path, "a"))
+    assert not scheduler.is_active(Path(tmp_path, "c"))
+
+
+def test_dispatch(tmp_path, monkeypatch):
+    monkeypatch.setattr(scheduler, "JOBS", Path(tmp_path, "jobs.db"))
+    monkeypatch.setattr(scheduler, "MAX_JOBS", 0)
+    monkeypatch.setattr(scheduler, "MAX_MEMORY", 100)
+    monkeypatch.setattr(scheduler, "MIN_MEMORY", 0)
+    monkeypatch.setattr(scheduler, "get_available_memory", lambda: 1000)
+    monkeypatch.setattr(scheduler, "start", lambda: None)
+    monkeypatch.setattr(scheduler, "_reap", lambda db: None)
+    launched = []
+    monkeypatch.setattr(
+        scheduler, "_launch", lambda job_id, *args: launched.append(job_id) or 0
+    )
+    large = scheduler.submit(Path(tmp_path, "a"), "run", {}, memory=200)
+    small = scheduler.submit(Path(tmp_path, "b"), "run", {}, memory=50)
+    urgent = scheduler.submit(Path(tmp_path, "c"), "resume", {}, 10, priority=1)
+    queue = scheduler.get_queue(Path(tmp_path, "b"))
+    assert [job["id"] for job in queue] == [urgent, large, small]
+    assert [job["own"] for job in queue] == [False, False, True]
+    assert scheduler.get_job(Path(tmp_path, "b"))["position"] == 3
+    # The large job has to wait for the urgent one, the small one behind it:
+    monkeypatch.setattr(scheduler, "MAX_JOBS", 2)
+    scheduler.dispatch()
+    assert launched == [urgent]
+    # Alone, the large job runs although it exceeds the limit:
+    db = scheduler.connect()
+    scheduler._finish(db, urgent, "done")
+    db.close()
+    scheduler.dispatch()
+    assert launched == [urgent, large]
+    # The small job does not fit next to it:
+    scheduler.dispatch()
+    assert launched == [urgent, large]
+
+
+def test_remove_workspaces(tmp_path, monkeypatch):
+    monkeypatch.setattr(scheduler, "JOBS", Path(tmp_path, "jobs.db"))
+    monkeypatch.setattr(scheduler, "MAX_JOBS", 0)
+    monkeypatch.setattr(scheduler, "start", lambda: None)
+    monkeypatch.setattr(utils, "WORKSPACES", Path(tmp_path, "workspaces"))
+    old, running, recent = (utils.get_workspace(name) for name in "abc")
+    Path(old, utils.LOGFILE.name).write_text("", encoding="utf-8")
+    scheduler.submit(running, "run", {})
+    week = time.time() - 8 * 24 * 60 * 60
+    for path in [old, Path(old, utils.LOGFILE.name), running]:
+        os.utime(str(path), (week, week))
+    scheduler.remove_workspaces(days=7)
+    assert sorted(utils.WORKSPACES.iterdir()) == [running, recent]
+
+
+def test_estimate_memory():
+    parameters = {"n_documents": 100, "n_types": 1000, "n_topics": 10}
+    memory = scheduler.estimate_memory(parameters)
+    assert memory >= 100 * 1000 * 8
+    parameters["n_topics"] = 20
+    assert scheduler.estimate_memory(parameters) > memory
+
+
+def test_get_available_memory():
+    memory = scheduler.get_available_memory()
+    assert memory is None or memory > 0
+
+
+def test_get_workspace(tmp_path, monkeypatch):
+    monkeypatch.setattr(utils, "WORKSPACES", tmp_path)
+    workspace = utils.get_workspace("../session")
+    assert workspace.parent == tmp_path
+    assert workspace.is_dir()
+    assert utils.get_path(utils.DATABASE) == utils.DATABASE
@@ -0,0 +1,60 @@
+from pathlib import Path
+import json
+import statistics
+import subprocess
+import sys
+
+
+ROOT = Path(__file__).absolute().parent.parent
+HEAVY = ["cophi", "lda", "numpy", "pandas"]
+SCRIPT = """
+import json
+import sys
+import time
+
+start = time.perf_counter()
+sys.path.insert(0, {root!r})
+from topicsexplorer import views
+
+imported = time.perf_counter()
+response = views.web.test_client().get("/")
+rendered = time.perf_counter()
+print(json.dumps({{
+    "status": response.status_code,
+    "import": imported - start,
+    "home": rendered - start,
+    "modules": [name for name in {heavy!r} if name in sys.modules],
+}}))
+"""
+
+
+def measure():
+    """Import the app and render the home page in a fresh interpreter."""
+    script = SCRIPT.format(root=str(ROOT), heavy=HEAVY)
+    output = subprocess.run(
+        [sys.executable, "-c", script],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL,
+        check=True,
+    ).stdout
+    return json.loads(output.decode("utf-8").strip().split("\n")[-1])
+
+
+def test_startup():
+    startup = measure()
+    assert startup["status"] == 200
+    # Scientific libraries are loaded by modeling jobs and data views only:
+    assert startup["modules"] == []
+
+
+if __name__ == "__main__":
+    # Benchmark: python tests/test_startup.py [runs]
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    startups = [measure() for _ in range(runs)]
+    for name in ("import", "home"):
+        seconds = [startup[name] for startup in startups]
+        print(
+            "{:<7} median {:.3f}s, min {:.3f}s, max {:.3f}s".format(
+                name, statistics.median(seconds), min(seconds), max(seconds)
+            )
+        )
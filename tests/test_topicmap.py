@@ -0,0 +1,54 @@
+from pathlib import Path
+import sys
+
+import numpy as np
+
+sys.path.insert(0, str(Path(".").absolute()))
+
+from topicsexplorer import topicmap
+
+
+def test_get_embedding():
+    points = np.array([[0, 0], [3, 0], [0, 4], [3, 4]], dtype=float)
+    distances = np.linalg.norm(points[:, np.newaxis] - points, axis=2)
+    coordinates = topicmap.get_embedding(distances)
+    # Distances are preserved, up to rotation and reflection:
+    embedded = np.linalg.norm(coordinates[:, np.newaxis] - coordinates, axis=2)
+    assert np.allclose(embedded, distances)
+
+
+def test_get_landmark_embedding():
+    random_state = np.random.RandomState(1)
+    points = random_state.rand(50, 2)
+    distances = np.linalg.norm(points[:, np.newaxis] - points, axis=2)
+    landmarks = np.arange(0, 50, 5)
+    landmark = topicmap.get_landmark_embedding(distances[:, landmarks], landmarks)
+    # Points off the landmarks are placed exactly, too:
+    embedded = np.linalg.norm(landmark[:, np.newaxis] - landmark, axis=2)
+    assert np.allclose(embedded, distances)
+
+
+def test_cluster():
+    points = np.array([0, 1, 10, 12, 30], dtype=float)
+    distances = np.abs(points[:, np.newaxis] - points)
+    linkage = topicmap.cluster(distances)
+    assert linkage.tolist() == [
+        [0, 1, 1, 2],
+        [2, 3, 2, 2],
+        [5, 6, 10.5, 4],
+        [4, 7, 24.25, 5],
+    ]
+    assert topicmap.get_clusters(linkage, 1).tolist() == [0, 0, 0, 0, 0]
+    assert topicmap.get_clusters(linkage, 3).tolist() == [1, 1, 2, 2, 0]
+    assert topicmap.get_clusters(linkage, 5).tolist() == [0, 1, 2, 3, 4]
+
+
+def test_get_document_map():
+    random_state = np.random.RandomState(2)
+    document_topic = random_state.dirichlet([0.1] * 4, size=30)
+    document_map = topicmap.get_document_map(document_topic, landmarks=10)
+    assert len(document_map["x"]) == len(document_map["cluster"]) == 30
+    assert len(document_map["landmarks"]) == 10
+    assert max(document_map["cluster"]) == topicmap.get_number_of_clusters(10) - 1
+    # Landmarks are drawn with a fixed seed:
+    assert document_map == topicmap.get_document_map(document_topic, landmarks=10)
@@ -1,15 +1,17 @@
 import logging
 from pathlib import Path
 import sys
+import threading
 import xml
 
 import cophi
 import numpy as np
+import pandas as pd
 import pytest
 
 sys.path.insert(0, str(Path(".").absolute()))
 
-from application import utils
+from topicsexplorer import utils
 
 
 TEST_STRING = "very-nice-great-success"
@@ -55,6 +57,42 @@ def test_remove_markup():
         text = "<tag>{}</anothertag>".format(TEST_STRING)
         utils.remove_markup(text)
 
+def test_remove_markup_selection():
+    text = (
+        '<TEI xmlns="http://www.tei-c.org/ns/1.0">'
+        "<teiHeader>Header</teiHeader><text><front>Front</front>"
+        "<body><p>Body</p> <note>Note</note></body></text></TEI>"
+    )
+    assert utils.remove_markup(text) == "HeaderFrontBody Note"
+    assert utils.remove_markup(text, exclude=["teiHeader"]) == "FrontBody Note"
+    assert utils.remove_markup(text, include=["body"], exclude=["note"]) == "Body "
+
+
+def test_remove_markup_html():
+    text = "<html><head><script>var a;</script><title>A</title><body><p>B<br>C</p>"
+    assert utils.remove_markup(text, markup="html") == "ABC"
+    assert utils.remove_markup(text, markup="html", include=["BODY"]) == "BC"
+    # End tags may be left out, void elements have none:
+    text = "<p>a<ul><li>c<li>d</ul><p>e<img>f<br/>g</p><p>h"
+    assert utils.remove_markup(text, markup="html", exclude=["li"]) == "aefgh"
+    assert utils.remove_markup(text, markup="html", include=["li"]) == "cd"
+    assert utils.remove_markup(text, markup="html", exclude=["img"]) == "acdefgh"
+
+
+def test_iter_text():
+    chunks = [b"<tag>very-nice", b"-great-suc", b"\xc3", b"\xa4ss</tag>"]
+    assert "".join(utils.iter_text(chunks)) == "very-nice-great-suc\u00e4ss"
+    assert "".join(utils.iter_text(chunks, "html")) == "very-nice-great-suc\u00e4ss"
+
+
+def test_get_paragraphs():
+    text = "abcde\n\nfg\n\n\n\nh"
+    paragraphs = list(utils.get_paragraphs(text, size=2))
+    assert paragraphs == [(0, "ab"), (2, "cd"), (4, "e"), (7, "fg"), (13, "h")]
+    for position, paragraph in paragraphs:
+        assert text[position : position + len(paragraph)] == paragraph
+
+
 def test_get_documents():
     textfiles = [("A", "This is a document.")]
     documents = list(utils.get_documents(textfiles))
@@ -70,17 +108,143 @@ def test_get_data():
     # TODO
     pass
 
-def test_get_topics():
-    # TODO
-    pass
+def test_get_topic_words():
+    class Model:
+        topic_word_ = np.array([[0.1, 0.5, 0.4], [0.7, 0.1, 0.2]])
+
+    words, weights = utils.get_topic_words(Model, maximum=2)
+    assert words.tolist() == [[1, 2], [0, 2]]
+    assert weights.dtype == np.float32
+    assert np.allclose(weights, [[0.5, 0.4], [0.7, 0.2]])
+    descriptors = list(utils.get_descriptors(words, ["a", "b", "c"]))
+    assert descriptors == ["b, c, ...", "a, c, ..."]
+    words = [[1, 2], [0, 2], [1, 2]]
+    descriptors = list(utils.get_descriptors(words, ["a", "b", "c"]))
+    assert descriptors == ["b, c, ... (0)", "a, c, ...", "b, c, ... (2)"]
 
 def test_get_document_topic():
-    # TODO
-    pass
+    class Model:
+        doc_topic_ = np.array([[0.25, 0.75], [0.5, 0.5]])
+
+    document_topic = utils.get_document_topic(Model, ["A", "B"], ["x", "y"])
+    assert document_topic.values.dtype == np.float32
+    assert document_topic.loc["A", "y"] == 0.75
+    assert utils.get_precision("float32") == 7
+    assert utils.get_precision("float64") == 15
+    # Seven significant digits of 0.0000123 take eleven decimals:
+    assert utils.get_precision("float32", [0.5, 0.0000123, 0]) == 11
+    assert utils.get_precision("float32", [0.5, 1e-20]) == 15
 
 def test_get_cosine():
     matrix = np.array([[1, 2], [1, 3]])
     descriptors = ["A", "B"]
+    similarites = utils.get_cosine(matrix, descriptors, dtype="float64")
+    assert np.isclose(similarites.sum().sum(), 3.9611613513818402)
     similarites = utils.get_cosine(matrix, descriptors)
-    assert similarites.sum().sum() == 3.9611613513818402
-
+    assert similarites.values.dtype == np.float32
+    assert np.allclose(similarites.values, [[1, 0.9805807], [0.9805807, 1]])
+    assert matrix.tolist() == [[1, 2], [1, 3]]
+
+
+def test_prune_vocabulary():
+    dtm = pd.DataFrame(
+        [[5, 1, 2, np.nan], [5, 1, 2, 3], [5, np.nan, np.nan, 1]],
+        columns=["a", "b", "c", "d"],
+    )
+    pruned, report = utils.prune_vocabulary(dtm, ["a"])
+    assert list(pruned.columns) == ["c", "d"]
+    assert report["stopwords"] == {"types": 1, "tokens": 15}
+    assert report["hapax"] == {"types": 1, "tokens": 2}
+    pruned, report = utils.prune_vocabulary(dtm, min_df=0.9)
+    assert list(pruned.columns) == ["a"]
+    pruned, report = utils.prune_vocabulary(dtm, max_df=2, max_features=1)
+    assert list(pruned.columns) == ["c"]
+    assert report["max_features"]["types"] == 1
+
+
+def test_get_metadata(tmp_path):
+    titles = ["Dickens_Bleak-House_1853", "Austen_Emma_1815", "Anonymous"]
+    metadata = list(utils.get_metadata(titles, fields=["author", "-", "year"]))
+    assert metadata == [
+        ("Dickens_Bleak-House_1853", "author", "Dickens"),
+        ("Dickens_Bleak-House_1853", "year", "1853"),
+        ("Austen_Emma_1815", "author", "Austen"),
+        ("Austen_Emma_1815", "year", "1815"),
+        ("Anonymous", "author", "Anonymous"),
+    ]
+    path = Path(tmp_path, "metadata.csv")
+    path.write_text(
+        "filename,genre,country\n"
+        "Austen_Emma_1815.txt,novel,\n"
+        "Anonymous.xml,poem, UK\n"
+        "Unknown.txt,novel,UK\n",
+        encoding="utf-8",
+    )
+    metadata = list(utils.get_metadata(titles, path))
+    assert metadata == [
+        ("Austen_Emma_1815", "genre", "novel"),
+        ("Anonymous", "genre", "poem"),
+        ("Anonymous", "country", "UK"),
+    ]
+
+
+def test_logfile(tmp_path):
+    path = Path(tmp_path, "topicsexplorer.log")
+    with utils.logfile(path):
+        logging.warning("Own session.")
+        other = threading.Thread(target=logging.warning, args=["Other session."])
+        other.start()
+        other.join()
+    assert path.read_text(encoding="utf-8") == "Own session.\n"
+
+
+def test_get_metadata_once(tmp_path):
+    titles = ["Dickens_1853", "Austen_1815"]
+    path = Path(tmp_path, "metadata.csv")
+    path.write_text(
+        "filename,author\n"
+        "Austen_1815.txt,Jane Austen\n"
+        "Austen_1815.txt,J. Austen\n",
+        encoding="utf-8",
+    )
+    # Every field once per document, the CSV file wins over the filename:
+    metadata = list(utils.get_metadata(titles, path, fields=["author", "year"]))
+    assert metadata == [
+        ("Dickens_1853", "author", "Dickens"),
+        ("Dickens_1853", "year", "1853"),
+        ("Austen_1815", "author", "Jane Austen"),
+        ("Austen_1815", "year", "1815"),
+    ]
+
+
+def test_get_metadata_filenames():
+    filenames = ["Charles Dickens_Bleak House_1853.txt", "Müller_Gedichte_1821.txt"]
+    titles = [utils.get_title(filename) for filename in filenames]
+    assert titles == ["Charles_Dickens_Bleak_House_1853", "Muller_Gedichte_1821"]
+    # Fields are parsed from the original filenames, not the titles:
+    metadata = list(
+        utils.get_metadata(
+            titles,
+            fields=["author", "title", "year"],
+            filenames=dict(zip(titles, filenames)),
+        )
+    )
+    assert metadata == [
+        ("Charles_Dickens_Bleak_House_1853", "author", "Charles Dickens"),
+        ("Charles_Dickens_Bleak_House_1853", "title", "Bleak House"),
+        ("Charles_Dickens_Bleak_House_1853", "year", "1853"),
+        ("Muller_Gedichte_1821", "author", "Müller"),
+        ("Muller_Gedichte_1821", "title", "Gedichte"),
+        ("Muller_Gedichte_1821", "year", "1821"),
+    ]
+
+
+def test_parse_number():
+    assert utils.parse_number("5") == 5
+    assert isinstance(utils.parse_number("1e3"), int)
+    assert utils.parse_number("1e3") == 1000
+    assert utils.parse_number("1.0") == 1.0
+    assert isinstance(utils.parse_number("1.0"), float)
+    assert utils.parse_number("1e-3") == 0.001
+    with pytest.raises(ValueError):
+        utils.parse_number("1.5")
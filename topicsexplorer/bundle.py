@@ -0,0 +1,368 @@
+import functools
+import json
+import logging
+from pathlib import Path
+import shutil
+
+import numpy as np
+
+from topicsexplorer import database
+from topicsexplorer import utils
+
+
+FORMAT = "topicsexplorer-bundle"
+VERSION = 2
+MANIFEST = "manifest.json"
+# Number of documents per shard:
+SHARD_SIZE = 1000
+
+
+def write(directory, shard_size=SHARD_SIZE):
+    """Write model output from the database into a read-only bundle."""
+    logging.info("Writing model bundle...")
+    directory = Path(directory)
+    if directory.exists():
+        raise FileExistsError("The bundle '{}' already exists.".format(directory))
+    descriptors, words, weights = database.select("topic_arrays")
+    document_topic = database.select("document_topic_distributions")[descriptors]
+    titles = list(document_topic.index)
+    document_similarities = database.select("document_similarities")
+    document_similarities = document_similarities.loc[titles, titles]
+    topic_similarities = database.select("topic_similarities")
+    topic_similarities = topic_similarities.loc[descriptors, descriptors]
+    sizes = dict(database.select("textfile_sizes"))
+    textfiles = dict(database.select("textfiles"))
+    token_freqs = json.loads(database.select("token_freqs"))
+
+    # Written next to the bundle and renamed, readers never see half of it:
+    tmp = directory.with_name("{}.tmp".format(directory.name))
+    if tmp.exists():
+        shutil.rmtree(str(tmp))
+    tmp.mkdir(parents=True)
+    vocabulary = database.select("vocabulary")
+    np.save(str(Path(tmp, "vocabulary.npy")), np.array(vocabulary, dtype=str))
+    np.save(str(Path(tmp, "words.npy")), words)
+    np.save(str(Path(tmp, "weights.npy")), weights)
+    _save(Path(tmp, "topic_similarities.npy"), topic_similarities.values)
+
+    shards = []
+    for start in range(0, len(titles), shard_size):
+        end = min(start + shard_size, len(titles))
+        shard = "shard-{:05d}".format(len(shards))
+        logging.info("Writing documents {} to {} into {}...".format(start, end, shard))
+        Path(tmp, shard).mkdir()
+        _save(Path(tmp, shard, "document_topic.npy"), document_topic.values[start:end])
+        _save(
+            Path(tmp, shard, "document_similarities.npy"),
+            document_similarities.values[start:end],
+        )
+        np.save(str(Path(tmp, shard, "tokens.npy")), np.array(token_freqs[start:end]))
+        _save_texts(Path(tmp, shard), (textfiles[t] for t in titles[start:end]))
+        shards.append(
+            {
+                "directory": shard,
+                "start": start,
+                "end": end,
+                "titles": titles[start:end],
+                "sizes": [int(sizes[title]) for title in titles[start:end]],
+            }
+        )
+
+    manifest = {
+        "format": FORMAT,
+        "version": VERSION,
+        "dtype": utils.get_dtype(),
+        "n_documents": len(titles),
+        "n_topics": len(descriptors),
+        "descriptors": descriptors,
+        "parameters": database.select("parameters")[0],
+        "stopwords": database.select("stopwords"),
+        "aggregates": database.select("aggregates"),
+        "diagnostics": database.select("diagnostics"),
+        "groups": {
+            name: database.select("group", name=name)
+            for name in database.select("group_names")
+        },
+        "shards": shards,
+    }
+    with Path(tmp, MANIFEST).open("w", encoding="utf-8") as file:
+        json.dump(manifest, file, ensure_ascii=False)
+    tmp.rename(directory)
+    logging.info("Successfully wrote model bundle.")
+    return directory
+
+
+def _save(path, array):
+    np.save(str(path), np.ascontiguousarray(array, dtype=utils.get_dtype()))
+
+
+def _save_texts(directory, texts):
+    # All texts of a shard in one file, with the byte offset of each, and the
+    # character position and byte range of every paragraph for ranged reads:
+    offsets = [0]
+    paragraphs = []
+    index = [0]
+    with Path(directory, "texts.bin").open("wb") as file:
+        for text in texts:
+            # Byte offset and character position after the last paragraph:
+            offset, end = offsets[-1], 0
+            for position, paragraph in utils.get_paragraphs(text):
+                offset += len(text[end:position].encode("utf-8"))
+                size = len(paragraph.encode("utf-8"))
+                paragraphs.append((position, offset, offset + size))
+                offset += size
+                end = position + len(paragraph)
+            index.append(len(paragraphs))
+            offsets.append(offsets[-1] + file.write(text.encode("utf-8")))
+    np.save(str(Path(directory, "texts.npy")), np.array(offsets, dtype=np.int64))
+    np.save(
+        str(Path(directory, "paragraphs.npy")),
+        np.array(paragraphs, dtype=np.int64).reshape(-1, 3),
+    )
+    np.save(
+        str(Path(directory, "paragraph_index.npy")), np.array(index, dtype=np.int64)
+    )
+
+
+@functools.lru_cache(maxsize=None)
+def load(directory):
+    """Open a bundle, its arrays are memory-mapped and shared between processes."""
+    logging.info("Opening model bundle...")
+    directory = Path(directory)
+    with Path(directory, MANIFEST).open("r", encoding="utf-8") as file:
+        manifest = json.load(file)
+    if manifest.get("format") != FORMAT or manifest.get("version") != VERSION:
+        raise ValueError("'{}' is not a supported model bundle.".format(directory))
+    bundle = {
+        "manifest": manifest,
+        "vocabulary": _load(directory, "vocabulary"),
+        "words": _load(directory, "words"),
+        "weights": _load(directory, "weights"),
+        "topic_similarities": _load(directory, "topic_similarities"),
+        "topics": {d: n for n, d in enumerate(manifest["descriptors"])},
+        "documents": {},
+        "shards": [],
+    }
+    for n, shard in enumerate(manifest["shards"]):
+        path = Path(directory, shard["directory"])
+        texts = Path(path, "texts.bin")
+        bundle["shards"].append(
+            {
+                "document_topic": _load(path, "document_topic"),
+                "document_similarities": _load(path, "document_similarities"),
+                "tokens": _load(path, "tokens"),
+                "offsets": _load(path, "texts"),
+                "paragraphs": _load(path, "paragraphs"),
+                "paragraph_index": _load(path, "paragraph_index"),
+                # Memory-mapping an empty file is not possible:
+                "texts": (
+                    np.memmap(str(texts), dtype=np.uint8, mode="r")
+                    if texts.stat().st_size
+                    else np.zeros(0, dtype=np.uint8)
+                ),
+            }
+        )
+        for row, title in enumerate(shard["titles"]):
+            bundle["documents"][title] = n, row
+    return bundle
+
+
+def _load(directory, name):
+    return np.load(str(Path(directory, "{}.npy".format(name))), mmap_mode="r")
+
+
+def select(directory, value, **kwargs):
+    """Select values from a bundle, like from the database."""
+    bundle = load(str(directory))
+    if value in {"token_freqs"}:
+        return _select_token_freqs(bundle)
+    elif value in {"document_topic_distributions"}:
+        return _select_document_topic_distributions(bundle)
+    elif value in {"topics"}:
+        return _select_topics(bundle, **kwargs)
+    elif value in {"topic_words"}:
+        return _select_topic_words(bundle, **kwargs)
+    elif value in {"textfile"}:
+        return _select_textfile(bundle, **kwargs)
+    elif value in {"textfile_page"}:
+        return _select_textfile_page(bundle, **kwargs)
+    elif value in {"document_similarities"}:
+        return _select_document_similarities(bundle)
+    elif value in {"topic_similarities"}:
+        return _select_topic_similarities(bundle)
+    elif value in {"stopwords"}:
+        return bundle["manifest"]["stopwords"]
+    elif value in {"data_export"}:
+        return _select_data_export(bundle)
+    elif value in {"parameters"}:
+        return (bundle["manifest"]["parameters"],)
+    elif value in {"textfile_sizes"}:
+        return _select_textfile_sizes(bundle)
+    elif value in {"aggregate"}:
+        return bundle["manifest"]["aggregates"][kwargs["name"]]
+    elif value in {"aggregates"}:
+        return bundle["manifest"]["aggregates"]
+    elif value in {"diagnostics"}:
+        return bundle["manifest"]["diagnostics"]
+    elif value in {"topic_diagnostics"}:
+        return _select_topic_diagnostics(bundle, **kwargs)
+    elif value in {"document_topics"}:
+        return _select_document_topics(bundle, **kwargs)
+    elif value in {"topic_documents"}:
+        return _select_topic_documents(bundle, **kwargs)
+    elif value in {"similar_documents"}:
+        return _select_similar_documents(bundle, **kwargs)
+    elif value in {"similar_topics"}:
+        return _select_similar_topics(bundle, **kwargs)
+    elif value in {"group_names"}:
+        return list(bundle["manifest"]["groups"])
+    elif value in {"group"}:
+        # A copy, callers may modify it:
+        return json.loads(json.dumps(bundle["manifest"]["groups"][kwargs["name"]]))
+    raise ValueError("'{}' is not available in a model bundle.".format(value))
+
+
+def _to_frame(matrix, index, columns):
+    import pandas as pd
+
+    return pd.DataFrame(matrix, index=index, columns=columns)
+
+
+def _get_titles(bundle):
+    return [
+        title for shard in bundle["manifest"]["shards"] for title in shard["titles"]
+    ]
+
+
+def _select_token_freqs(bundle):
+    logging.info("Select token frequencies from bundle...")
+    tokens = [int(n) for shard in bundle["shards"] for n in shard["tokens"]]
+    return json.dumps(tokens)
+
+
+def _select_document_topic_distributions(bundle):
+    logging.info("Select document-topic distributions from bundle...")
+    matrix = np.concatenate([shard["document_topic"] for shard in bundle["shards"]])
+    descriptors = bundle["manifest"]["descriptors"]
+    return _to_frame(matrix, _get_titles(bundle), descriptors)
+
+
+def _select_document_similarities(bundle):
+    logging.info("Select document similarity matrix from bundle...")
+    titles = _get_titles(bundle)
+    matrix = np.concatenate(
+        [shard["document_similarities"] for shard in bundle["shards"]]
+    )
+    return _to_frame(matrix, titles, titles)
+
+
+def _select_topic_similarities(bundle):
+    logging.info("Select topic similarity matrix from bundle...")
+    descriptors = bundle["manifest"]["descriptors"]
+    return _to_frame(bundle["topic_similarities"], descriptors, descriptors)
+
+
+def _select_document_topics(bundle, title):
+    logging.info("Select topics of '{}' from bundle...".format(title))
+    # Only the row of the document is read, from the shard holding it:
+    shard, row = bundle["documents"][title]
+    weights = bundle["shards"][shard]["document_topic"][row]
+    return dict(zip(bundle["manifest"]["descriptors"], weights.tolist()))
+
+
+def _select_topic_documents(bundle, topic):
+    logging.info("Select documents of '{}' from bundle...".format(topic))
+    topic = bundle["topics"][topic]
+    weights = [shard["document_topic"][:, topic] for shard in bundle["shards"]]
+    return dict(zip(_get_titles(bundle), np.concatenate(weights).tolist()))
+
+
+def _select_similar_documents(bundle, title):
+    logging.info("Select similarities of '{}' from bundle...".format(title))
+    shard, row = bundle["documents"][title]
+    similarities = bundle["shards"][shard]["document_similarities"][row]
+    return dict(zip(_get_titles(bundle), similarities.tolist()))
+
+
+def _select_similar_topics(bundle, topic):
+    logging.info("Select similarities of '{}' from bundle...".format(topic))
+    similarities = bundle["topic_similarities"][bundle["topics"][topic]]
+    return dict(zip(bundle["manifest"]["descriptors"], similarities.tolist()))
+
+
+def _select_topics(bundle, n=100):
+    logging.info("Select topics from bundle...")
+    vocabulary = bundle["vocabulary"]
+    return json.dumps(
+        {
+            descriptor: [str(vocabulary[i]) for i in words[:n]]
+            for descriptor, words in zip(
+                bundle["manifest"]["descriptors"], bundle["words"]
+            )
+        },
+        ensure_ascii=False,
+    )
+
+
+def _select_topic_words(bundle, topic, n=15):
+    logging.info("Select words of '{}' from bundle...".format(topic))
+    topic = bundle["topics"][topic]
+    words = bundle["words"][topic, :n]
+    weights = bundle["weights"][topic, :n]
+    vocabulary = bundle["vocabulary"]
+    return [(str(vocabulary[i]), float(weight)) for i, weight in zip(words, weights)]
+
+
+def _select_textfile(bundle, title):
+    logging.info("Select '{}' from bundle...".format(title))
+    shard, row = bundle["documents"][title]
+    shard = bundle["shards"][shard]
+    start, end = shard["offsets"][row], shard["offsets"][row + 1]
+    return bytes(shard["texts"][start:end]).decode("utf-8")
+
+
+def _select_textfile_page(bundle, title, page):
+    logging.info("Select page {} of '{}' from bundle...".format(page, title))
+    shard, row = bundle["documents"][title]
+    shard = bundle["shards"][shard]
+    first, last = shard["paragraph_index"][row : row + 2]
+    paragraphs = shard["paragraphs"][first:last]
+    # Paragraphs are sorted by position, only those of the page are decoded:
+    start = page * utils.PAGE_SIZE
+    begin, end = np.searchsorted(paragraphs[:, 0], [start, start + utils.PAGE_SIZE])
+    pages = int(paragraphs[-1, 0]) // utils.PAGE_SIZE + 1 if len(paragraphs) else 0
+    return (
+        [
+            bytes(shard["texts"][start:end]).decode("utf-8")
+            for _, start, end in paragraphs[begin:end]
+        ],
+        pages,
+    )
+
+
+def _select_textfile_sizes(bundle):
+    logging.info("Select textfile sizes from bundle...")
+    return [
+        (title, size)
+        for shard in bundle["manifest"]["shards"]
+        for title, size in zip(shard["titles"], shard["sizes"])
+    ]
+
+
+def _select_topic_diagnostics(bundle, topic):
+    diagnostics = bundle["manifest"]["diagnostics"]
+    if topic not in bundle["topics"] or not diagnostics:
+        return None
+    row = dict(diagnostics[bundle["topics"][topic]])
+    del row["topic"]
+    return row
+
+
+def _select_data_export(bundle):
+    model = (
+        _select_document_topic_distributions(bundle),
+        _select_topics(bundle),
+        _select_document_similarities(bundle),
+        _select_topic_similarities(bundle),
+    )
+    return model, bundle["manifest"]["stopwords"]
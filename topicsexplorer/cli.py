@@ -0,0 +1,160 @@
+import argparse
+import glob
+import logging
+from pathlib import Path
+import sys
+import uuid
+
+import flask
+
+from topicsexplorer import utils
+from topicsexplorer import workflow
+
+
+SUFFIXES = {".txt", ".xml", ".html"}
+
+
+def main(argv=None):
+    """Run the topic modeling workflow from the command-line."""
+    args = parse_args(argv)
+    logging.basicConfig(
+        level=logging.WARNING if args.quiet else logging.INFO,
+        format="%(asctime)s %(message)s",
+        stream=sys.stdout,
+    )
+    app = utils.init_app("topicsexplorer")
+    with app.app_context():
+        flask.g.paths = {}
+        if args.database:
+            flask.g.paths[utils.DATABASE] = Path(args.database)
+        if args.checkpoint:
+            flask.g.paths[utils.CHECKPOINT] = Path(args.checkpoint)
+        if set(flask.g.paths) != {utils.DATABASE, utils.CHECKPOINT}:
+            # Files not given go into a workspace of the run, runs can go in parallel:
+            flask.g.workspace = utils.get_workspace("cli-{}".format(uuid.uuid4().hex))
+        flask.g.dtype = args.dtype
+        # Reading from a served bundle makes no sense here:
+        flask.g.bundle = None
+        try:
+            logging.info(
+                "Writing into '{}'...".format(utils.get_path(utils.DATABASE))
+            )
+            utils.init_db(app)
+            workflow.run(get_data(args))
+            if args.bundle:
+                from topicsexplorer import bundle
+
+                bundle.write(args.bundle, args.shard_size)
+        except Exception as error:
+            logging.error("ERROR: {}".format(error))
+            return 1
+    return 0
+
+
+def parse_args(argv=None):
+    """Parse command-line arguments."""
+    parser = argparse.ArgumentParser(
+        prog="topicsexplorer",
+        description="Train a topic model without the web interface.",
+    )
+    parser.add_argument(
+        "corpus",
+        nargs="+",
+        help="text files, directories or glob patterns (.txt, .xml, .html)",
+    )
+    parser.add_argument("--topics", type=int, default=10, help="number of topics")
+    parser.add_argument(
+        "--iterations", type=int, default=100, help="number of sampling iterations"
+    )
+    stopwords = parser.add_mutually_exclusive_group()
+    stopwords.add_argument(
+        "--mfw", type=int, default=100, help="number of most frequent words to remove"
+    )
+    stopwords.add_argument("--stopwords", help="external list of words to remove")
+    parser.add_argument("--seed", type=int, help="random state of the sampler")
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.0,
+        help="stop early if the log-likelihood improves less than this",
+    )
+    parser.add_argument(
+        "--include",
+        type=utils.parse_names,
+        default=[],
+        help="comma-separated XML/HTML elements to read text from, e.g. body",
+    )
+    parser.add_argument(
+        "--exclude",
+        type=utils.parse_names,
+        default=["teiHeader"],
+        help="comma-separated XML/HTML elements to skip (default: teiHeader)",
+    )
+    parser.add_argument("--metadata", help="CSV file with a row of metadata per file")
+    parser.add_argument(
+        "--fields",
+        type=utils.parse_names,
+        default=[],
+        help="comma-separated metadata in filenames split at _, e.g. author,-,year",
+    )
+    parser.add_argument("--min-df", type=utils.parse_number, default=1)
+    parser.add_argument("--max-df", type=utils.parse_number, default=1.0)
+    parser.add_argument("--max-features", type=utils.parse_number)
+    parser.add_argument(
+        "--dtype",
+        choices=["float32", "float64"],
+        default=utils.DTYPE,
+        help="precision of the stored distributions and similarities",
+    )
+    parser.add_argument("--database", help="SQLite database to write into")
+    parser.add_argument("--checkpoint", help="file for the sampler checkpoints")
+    parser.add_argument("--bundle", help="also write a read-only model bundle")
+    parser.add_argument(
+        "--shard-size", type=int, default=1000, help="documents per bundle shard"
+    )
+    parser.add_argument("--quiet", action="store_true", help="only log errors")
+    return parser.parse_args(argv)
+
+
+def get_data(args):
+    """Get data from command-line arguments."""
+    logging.info("Processing user data...")
+    paths = list(get_paths(args.corpus))
+    data = {
+        "corpus": [str(path) for path in paths],
+        "filenames": [path.name for path in paths],
+        "topics": args.topics,
+        "iterations": args.iterations,
+        "seed": args.seed if args.seed is not None else utils.get_seed(),
+        "tolerance": args.tolerance,
+        "min_df": args.min_df,
+        "max_df": args.max_df,
+        "max_features": args.max_features,
+        "include": args.include,
+        "exclude": args.exclude,
+        "fields": args.fields,
+    }
+    if args.metadata:
+        data["metadata"] = args.metadata
+    if args.stopwords:
+        data["stopwords"] = args.stopwords
+    else:
+        data["mfw"] = args.mfw
+    return data
+
+
+def get_paths(patterns):
+    """Expand directories and glob patterns to text files."""
+    for pattern in patterns:
+        path = Path(pattern)
+        if path.is_dir():
+            paths = sorted(p for p in path.iterdir() if p.suffix in SUFFIXES)
+        else:
+            paths = sorted(Path(p) for p in glob.glob(pattern))
+        if not paths:
+            raise FileNotFoundError("No text files found for '{}'.".format(pattern))
+        yield from paths
+
+
+if __name__ == "__main__":
+    sys.exit(main())
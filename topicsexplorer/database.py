@@ -1,3 +1,4 @@
+import json
 import logging
 import sqlite3
 
@@ -6,11 +7,14 @@ import flask
 from topicsexplorer import utils
 
 
+DIAGNOSTICS = ["umass", "npmi", "tokens", "share", "exclusivity", "overlap"]
+
+
 def get_db():
     """Create connection to SQLite database."""
     logging.info("Connecting to database...")
     if "db" not in flask.g:
-        flask.g.db = sqlite3.connect(str(utils.DATABASE))
+        flask.g.db = sqlite3.connect(str(utils.get_path(utils.DATABASE)))
     return flask.g.db
 
 
@@ -23,14 +27,21 @@ def close_db(e=None):
 
 
 def _insert_into_textfiles(db, data):
-    for textfile in data:
-        title, content = utils.load_textfile(textfile)
+    for title, content in data:
         if content:
             logging.info("Insert '{}' into database...".format(title))
             db.execute(
                 "INSERT INTO textfiles (title, content) VALUES(?, ?);",
                 [title, content],
             )
+            # Paragraphs with their character offsets allow ranged reads:
+            db.executemany(
+                "INSERT INTO paragraphs (title, position, content) VALUES(?, ?, ?);",
+                (
+                    [title, position, paragraph]
+                    for position, paragraph in utils.get_paragraphs(content)
+                ),
+            )
 
 
 def _insert_into_token_freqs(db, data):
@@ -54,6 +65,8 @@ def insert_into(table, data):
         _insert_into_model(db, data)
     elif table in {"parameters"}:
         _insert_into_parameters(db, data)
+    elif table in {"metadata"}:
+        _insert_into_metadata(db, data)
     db.commit()
     close_db()
 
@@ -63,6 +76,18 @@ def update(table, data):
     db = get_db()
     if table in {"textfiles"}:
         _update_textfile_sizes(db, data)
+    elif table in {"parameters"}:
+        _update_parameters(db, data)
+    elif table in {"model"}:
+        _update_model(db, data)
+    elif table in {"aggregates"}:
+        _update_aggregates(db, data)
+    elif table in {"topics"}:
+        _update_topics(db, data)
+    elif table in {"diagnostics"}:
+        _update_diagnostics(db, data)
+    elif table in {"groups"}:
+        _update_groups(db, data)
     db.commit()
     close_db()
 
@@ -76,6 +101,84 @@ def _update_textfile_sizes(db, data):
         )
 
 
+def _update_parameters(db, data):
+    logging.info("Update parameters in database...")
+    db.execute(
+        "UPDATE parameters SET content = ?;",
+        [data],
+    )
+
+
+def _update_model(db, data):
+    # A resumed model replaces the output of the previous run:
+    db.execute("DELETE FROM model;")
+    _insert_into_model(db, data)
+
+
+def _update_topics(db, data):
+    logging.info("Update vocabulary and topics in database...")
+    db.execute("DELETE FROM vocabulary;")
+    db.executemany(
+        "INSERT INTO vocabulary (id, word) VALUES(?, ?);",
+        enumerate(map(str, data["vocabulary"])),
+    )
+    db.execute("DELETE FROM topics;")
+    # Term ids and weights of each topic as compact int32/float32 arrays:
+    topics = zip(data["descriptors"], data["words"], data["weights"])
+    db.executemany(
+        "INSERT INTO topics (id, descriptor, words, weights) VALUES(?, ?, ?, ?);",
+        (
+            [
+                n,
+                descriptor,
+                words.astype("<i4").tobytes(),
+                weights.astype("<f4").tobytes(),
+            ]
+            for n, (descriptor, words, weights) in enumerate(topics)
+        ),
+    )
+
+
+def _update_diagnostics(db, data):
+    logging.info("Update topic diagnostics in database...")
+    db.execute("DELETE FROM diagnostics;")
+    columns = [data[name].tolist() for name in DIAGNOSTICS]
+    db.executemany(
+        "INSERT INTO diagnostics (topic, umass, npmi, tokens, share, exclusivity, "
+        "overlap) VALUES(?, ?, ?, ?, ?, ?, ?);",
+        ([n, *row] for n, row in enumerate(zip(*columns))),
+    )
+
+
+def _update_groups(db, data):
+    logging.info("Update topic weights of groups in database...")
+    db.execute("DELETE FROM groups;")
+    # Summed topic weights of each group as float32 array:
+    db.executemany(
+        "INSERT INTO groups (name, value, documents, tokens, weights) "
+        "VALUES(?, ?, ?, ?, ?);",
+        (
+            [
+                name,
+                str(value),
+                int(documents),
+                int(tokens),
+                weights.astype("<f4").tobytes(),
+            ]
+            for name, value, documents, tokens, weights in data
+        ),
+    )
+
+
+def _update_aggregates(db, data):
+    logging.info("Update aggregates in database...")
+    db.execute("DELETE FROM aggregates;")
+    db.executemany(
+        "INSERT INTO aggregates (name, content) VALUES(?, ?);",
+        data.items(),
+    )
+
+
 def _insert_into_parameters(db, data):
     logging.info("Insert parameters into database...")
     db.execute(
@@ -85,18 +188,32 @@ def _insert_into_parameters(db, data):
 
 
 def _insert_into_model(db, data):
+    import numpy as np
+
     logging.info("Insert topic model output into database...")
+    # Matrices as compact little-endian float32/float64 arrays, with their dtype:
+    dtype = np.dtype(data["document_topic"].dtype).newbyteorder("<")
     db.execute(
-        "INSERT INTO model (document_topic, topics, document_similarities, topic_similarities) VALUES(?, ?, ?, ?);",
+        "INSERT INTO model (dtype, titles, document_topic, document_similarities, "
+        "topic_similarities) VALUES(?, ?, ?, ?, ?);",
         [
-            data["document_topic"],
-            data["topics"],
-            data["document_similarities"],
-            data["topic_similarities"],
+            dtype.str,
+            json.dumps(list(data["titles"]), ensure_ascii=False),
+            data["document_topic"].astype(dtype).tobytes(),
+            data["document_similarities"].astype(dtype).tobytes(),
+            data["topic_similarities"].astype(dtype).tobytes(),
         ],
     )
 
 
+def _insert_into_metadata(db, data):
+    logging.info("Insert metadata into database...")
+    db.executemany(
+        "INSERT INTO metadata (title, name, value) VALUES(?, ?, ?);",
+        data,
+    )
+
+
 def _insert_into_stopwords(db, data):
     logging.info("Insert stopwords into database...")
     db.execute(
@@ -107,6 +224,12 @@ def _insert_into_stopwords(db, data):
 
 def select(value, **kwargs):
     """Select values from database."""
+    directory = utils.get_bundle()
+    if directory:
+        # Serving a read-only model bundle instead:
+        from topicsexplorer import bundle
+
+        return bundle.select(directory, value, **kwargs)
     db = get_db()
     cursor = db.cursor()
     if value in {"textfiles"}:
@@ -116,9 +239,13 @@ def select(value, **kwargs):
     elif value in {"document_topic_distributions"}:
         return _select_document_topic_distributions(cursor)
     elif value in {"topics"}:
-        return _select_topics(cursor)
+        return _select_topics(cursor, **kwargs)
+    elif value in {"topic_words"}:
+        return _select_topic_words(cursor, **kwargs)
     elif value in {"textfile"}:
         return _select_textfile(cursor, **kwargs)
+    elif value in {"textfile_page"}:
+        return _select_textfile_page(cursor, **kwargs)
     elif value in {"document_similarities"}:
         return _select_document_similarities(cursor)
     elif value in {"topic_similarities"}:
@@ -131,6 +258,130 @@ def select(value, **kwargs):
         return _select_parameters(cursor)
     elif value in {"textfile_sizes"}:
         return _select_textfile_sizes(cursor)
+    elif value in {"aggregate"}:
+        return _select_aggregate(cursor, **kwargs)
+    elif value in {"aggregates"}:
+        return _select_aggregates(cursor)
+    elif value in {"topic_arrays"}:
+        return _select_topic_arrays(cursor)
+    elif value in {"vocabulary"}:
+        return _select_vocabulary(cursor)
+    elif value in {"diagnostics"}:
+        return _select_diagnostics(cursor)
+    elif value in {"metadata"}:
+        return _select_metadata(cursor)
+    elif value in {"group_names"}:
+        return _select_group_names(cursor)
+    elif value in {"group"}:
+        return _select_group(cursor, **kwargs)
+    elif value in {"topic_diagnostics"}:
+        return _select_topic_diagnostics(cursor, **kwargs)
+    elif value in {"document_topics"}:
+        return _select_document_topics(cursor, **kwargs)
+    elif value in {"topic_documents"}:
+        return _select_topic_documents(cursor, **kwargs)
+    elif value in {"similar_documents"}:
+        return _select_similar_documents(cursor, **kwargs)
+    elif value in {"similar_topics"}:
+        return _select_similar_topics(cursor, **kwargs)
+
+
+def _select_aggregate(cursor, name):
+    logging.info("Select '{}' from database...".format(name))
+    return cursor.execute(
+        "SELECT content FROM aggregates WHERE name = ?;",
+        [name],
+    ).fetchone()[0]
+
+
+def _select_aggregates(cursor):
+    logging.info("Select aggregates from database...")
+    return dict(cursor.execute("SELECT name, content FROM aggregates;").fetchall())
+
+
+def _select_topic_arrays(cursor):
+    import numpy as np
+
+    logging.info("Select topic arrays from database...")
+    descriptors, words, weights = zip(
+        *cursor.execute("SELECT descriptor, words, weights FROM topics ORDER BY id;")
+    )
+    words = np.stack([np.frombuffer(ids, dtype="<i4") for ids in words])
+    weights = np.stack([np.frombuffer(weight, dtype="<f4") for weight in weights])
+    return list(descriptors), words, weights
+
+
+def _select_vocabulary(cursor):
+    logging.info("Select vocabulary from database...")
+    return [
+        word for word, in cursor.execute("SELECT word FROM vocabulary ORDER BY id;")
+    ]
+
+
+def _select_metadata(cursor):
+    logging.info("Select metadata from database...")
+    return cursor.execute("SELECT title, name, value FROM metadata;").fetchall()
+
+
+def _select_group_names(cursor):
+    logging.info("Select group names from database...")
+    return [
+        name
+        for name, in cursor.execute(
+            "SELECT name FROM groups GROUP BY name ORDER BY MIN(id);"
+        )
+    ]
+
+
+def _select_group(cursor, name):
+    import numpy as np
+
+    logging.info("Select topic weights by '{}' from database...".format(name))
+    descriptors = [
+        descriptor
+        for descriptor, in cursor.execute("SELECT descriptor FROM topics ORDER BY id;")
+    ]
+    rows = cursor.execute(
+        "SELECT value, documents, tokens, weights FROM groups WHERE name = ? "
+        "ORDER BY id;",
+        [name],
+    ).fetchall()
+    values, documents, tokens, weights = zip(*rows) if rows else ([], [], [], [])
+    weights = np.array(
+        [np.frombuffer(weight, dtype="<f4") for weight in weights], dtype=np.float64
+    ).reshape(len(rows), len(descriptors))
+    # Share of the topics in all tokens of a group:
+    proportions = weights / np.maximum(np.array(tokens), 1)[:, np.newaxis]
+    return {
+        "name": name,
+        "topics": descriptors,
+        "values": list(values),
+        "documents": list(documents),
+        "tokens": list(tokens),
+        "weights": weights.tolist(),
+        "proportions": proportions.tolist(),
+    }
+
+
+def _select_diagnostics(cursor):
+    logging.info("Select topic diagnostics from database...")
+    rows = cursor.execute(
+        "SELECT descriptor, {} FROM diagnostics "
+        "JOIN topics ON topics.id = diagnostics.topic "
+        "ORDER BY topic;".format(", ".join(DIAGNOSTICS))
+    ).fetchall()
+    return [dict(zip(["topic"] + DIAGNOSTICS, row)) for row in rows]
+
+
+def _select_topic_diagnostics(cursor, topic):
+    logging.info("Select diagnostics of '{}' from database...".format(topic))
+    row = cursor.execute(
+        "SELECT {} FROM diagnostics "
+        "JOIN topics ON topics.id = diagnostics.topic "
+        "WHERE descriptor = ?;".format(", ".join(DIAGNOSTICS)),
+        [topic],
+    ).fetchone()
+    return None if row is None else dict(zip(DIAGNOSTICS, row))
 
 
 def _select_textfile_sizes(cursor):
@@ -150,12 +401,31 @@ def _select_stopwords(cursor):
 
 def _select_document_similarities(cursor):
     logging.info("Select document similarity matrix from database...")
-    return cursor.execute("SELECT document_similarities FROM model;").fetchone()[0]
+    return _select_matrix(cursor, "document_similarities")
 
 
 def _select_topic_similarities(cursor):
     logging.info("Select topic similarity matrix from database...")
-    return cursor.execute("SELECT topic_similarities FROM model;").fetchone()[0]
+    return _select_matrix(cursor, "topic_similarities")
+
+
+def _select_matrix(cursor, name):
+    import numpy as np
+    import pandas as pd
+
+    dtype, titles, matrix = cursor.execute(
+        "SELECT dtype, titles, {} FROM model;".format(name)
+    ).fetchone()
+    titles = json.loads(titles)
+    descriptors = [
+        descriptor
+        for descriptor, in cursor.execute("SELECT descriptor FROM topics ORDER BY id;")
+    ]
+    # Rows and columns are documents or topics, topics are rows of their table:
+    index = descriptors if name in {"topic_similarities"} else titles
+    columns = titles if name in {"document_similarities"} else descriptors
+    matrix = np.frombuffer(matrix, dtype=dtype).reshape(len(index), len(columns))
+    return pd.DataFrame(matrix, index=index, columns=columns)
 
 
 def _select_token_freqs(cursor):
@@ -170,12 +440,80 @@ def _select_textfiles(cursor):
 
 def _select_document_topic_distributions(cursor):
     logging.info("Select document-topic distributions from database...")
-    return cursor.execute("SELECT document_topic FROM model;").fetchone()[0]
+    return _select_matrix(cursor, "document_topic")
+
+
+def _select_document_topics(cursor, title):
+    logging.info("Select topics of '{}' from database...".format(title))
+    row = _select_matrix(cursor, "document_topic").loc[title]
+    return dict(zip(row.index, row.values.tolist()))
+
+
+def _select_topic_documents(cursor, topic):
+    logging.info("Select documents of '{}' from database...".format(topic))
+    column = _select_matrix(cursor, "document_topic")[topic]
+    return dict(zip(column.index, column.values.tolist()))
+
 
+def _select_similar_documents(cursor, title):
+    logging.info("Select similarities of '{}' from database...".format(title))
+    row = _select_matrix(cursor, "document_similarities").loc[title]
+    return dict(zip(row.index, row.values.tolist()))
+
+
+def _select_similar_topics(cursor, topic):
+    logging.info("Select similarities of '{}' from database...".format(topic))
+    row = _select_matrix(cursor, "topic_similarities").loc[topic]
+    return dict(zip(row.index, row.values.tolist()))
+
+
+def _select_topics(cursor, n=100):
+    import numpy as np
 
-def _select_topics(cursor):
     logging.info("Select topics from database...")
-    return cursor.execute("SELECT topics FROM model;").fetchone()[0]
+    topics = [
+        (descriptor, np.frombuffer(words, dtype="<i4")[:n])
+        for descriptor, words in cursor.execute(
+            "SELECT descriptor, words FROM topics ORDER BY id;"
+        )
+    ]
+    ids = np.unique(np.concatenate([words for _, words in topics]))
+    vocabulary = _select_words(cursor, ids)
+    return json.dumps(
+        {descriptor: [vocabulary[i] for i in words] for descriptor, words in topics},
+        ensure_ascii=False,
+    )
+
+
+def _select_topic_words(cursor, topic, n=15):
+    import numpy as np
+
+    logging.info("Select words of '{}' from database...".format(topic))
+    words, weights = cursor.execute(
+        "SELECT words, weights FROM topics WHERE descriptor = ?;",
+        [topic],
+    ).fetchone()
+    words = np.frombuffer(words, dtype="<i4")[:n]
+    weights = np.frombuffer(weights, dtype="<f4")[:n]
+    vocabulary = _select_words(cursor, words)
+    return [(vocabulary[i], float(weight)) for i, weight in zip(words, weights)]
+
+
+def _select_words(cursor, ids, batch=500):
+    # Look up only the words needed, in batches below SQLite's variable limit:
+    vocabulary = {}
+    ids = [int(i) for i in ids]
+    for start in range(0, len(ids), batch):
+        chunk = ids[start : start + batch]
+        vocabulary.update(
+            cursor.execute(
+                "SELECT id, word FROM vocabulary WHERE id IN ({});".format(
+                    ", ".join("?" * len(chunk))
+                ),
+                chunk,
+            )
+        )
+    return vocabulary
 
 
 def _select_textfile(cursor, title):
@@ -186,11 +524,30 @@ def _select_textfile(cursor, title):
     ).fetchone()[0]
 
 
+def _select_textfile_page(cursor, title, page):
+    logging.info("Select page {} of '{}' from database...".format(page, title))
+    start = page * utils.PAGE_SIZE
+    paragraphs = cursor.execute(
+        "SELECT content FROM paragraphs WHERE title = ? AND position >= ? AND position < ? ORDER BY position;",
+        [title, start, start + utils.PAGE_SIZE],
+    ).fetchall()
+    last = cursor.execute(
+        "SELECT MAX(position) FROM paragraphs WHERE title = ?;",
+        [title],
+    ).fetchone()[0]
+    pages = 0 if last is None else last // utils.PAGE_SIZE + 1
+    return [paragraph for paragraph, in paragraphs], pages
+
+
 def _select_data_export(cursor):
     stopwords = _select_stopwords(cursor)
+    topics = _select_topics(cursor)
 
     logging.info("Select model output from database...")
-    model = cursor.execute(
-        "SELECT document_topic, topics, document_similarities, topic_similarities FROM model;"
-    ).fetchone()
+    model = (
+        _select_matrix(cursor, "document_topic"),
+        topics,
+        _select_matrix(cursor, "document_similarities"),
+        _select_matrix(cursor, "topic_similarities"),
+    )
     return model, stopwords
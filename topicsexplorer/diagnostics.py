@@ -0,0 +1,94 @@
+import logging
+
+import numpy as np
+
+
+# Coherence is calculated between the top words of a topic:
+TOP_WORDS = 10
+# Maximum number of cells of a dense block of the document-word matrix:
+BLOCK_SIZE = 2 ** 22
+
+
+def get_diagnostics(model, words, documents, tokens, n=TOP_WORDS):
+    """Calculate coherence, size, exclusivity and word overlap of all topics."""
+    logging.info("Calculating topic diagnostics...")
+    n = min(n, words.shape[1])
+    top = words[:, :n]
+    # Only the top words are needed, with ids local to them:
+    vocabulary, local = np.unique(top, return_inverse=True)
+    local = local.reshape(top.shape)
+    n_documents = model.ndz_.shape[0]
+    occurrences = get_occurrences(documents, tokens, vocabulary)
+    cooccurrences = get_cooccurrences(*occurrences, len(vocabulary))
+    umass, npmi = get_coherence(local, cooccurrences, n_documents)
+    return {
+        "umass": umass,
+        "npmi": npmi,
+        "tokens": model.nz_.astype(np.int64),
+        "share": model.nz_ / model.nz_.sum(),
+        "exclusivity": get_exclusivity(model.topic_word_, top),
+        "overlap": get_overlap(local),
+    }
+
+
+def get_occurrences(documents, tokens, vocabulary):
+    """Get sorted, unique document-word pairs of the vocabulary from tokens."""
+    logging.info("Collecting document occurrences of top words...")
+    local = np.full(max(tokens.max(), vocabulary.max()) + 1, -1, dtype=np.int64)
+    local[vocabulary] = np.arange(len(vocabulary))
+    words = local[tokens]
+    selected = words >= 0
+    pairs = documents[selected].astype(np.int64) * len(vocabulary) + words[selected]
+    pairs = np.unique(pairs)
+    return pairs // len(vocabulary), pairs % len(vocabulary)
+
+
+def get_cooccurrences(documents, words, n_words):
+    """Count documents in which two words occur together (diagonal: alone)."""
+    logging.info("Counting document co-occurrences of top words...")
+    cooccurrences = np.zeros((n_words, n_words))
+    if not len(documents):
+        return cooccurrences
+    # Dense blocks of documents keep the memory bounded:
+    rows = max(BLOCK_SIZE // n_words, 1)
+    starts = np.searchsorted(documents, np.arange(0, documents[-1] + 1, rows))
+    for begin, end in zip(starts, np.append(starts[1:], len(documents))):
+        if begin == end:
+            continue
+        block_documents = documents[begin:end] - documents[begin]
+        block = np.zeros((block_documents[-1] + 1, n_words), dtype=np.float32)
+        block[block_documents, words[begin:end]] = 1
+        cooccurrences += block.T @ block
+    return cooccurrences
+
+
+def get_coherence(local, cooccurrences, n_documents):
+    """UMass and NPMI coherence of topics, averaged over pairs of top words."""
+    logging.info("Calculating topic coherence...")
+    frequencies = np.maximum(np.diag(cooccurrences), 1)
+    # Every word with all words ranked higher:
+    lower, higher = np.tril_indices(local.shape[1], -1)
+    joint = cooccurrences[local[:, lower], local[:, higher]]
+    umass = np.log((joint + 1) / frequencies[local[:, higher]]).mean(axis=1)
+
+    p_joint = joint / n_documents
+    p_lower = frequencies[local[:, lower]] / n_documents
+    p_higher = frequencies[local[:, higher]] / n_documents
+    with np.errstate(divide="ignore", invalid="ignore"):
+        npmi = np.log(p_joint / (p_lower * p_higher)) / -np.log(p_joint)
+    # Words never occurring together, and always occurring together:
+    npmi[joint == 0] = -1
+    npmi[joint == n_documents] = 1
+    return umass, npmi.mean(axis=1)
+
+
+def get_exclusivity(topic_word, top):
+    """Average share of the weight of a topic's top words in this topic."""
+    weights = np.take_along_axis(topic_word, top, axis=1)
+    return (weights / topic_word.sum(axis=0)[top]).mean(axis=1)
+
+
+def get_overlap(local):
+    """Share of a topic's top words also among the top words of other topics."""
+    topics = np.bincount(local.ravel(), minlength=local.max() + 1)
+    return (topics[local] > 1).mean(axis=1)
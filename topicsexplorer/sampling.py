@@ -0,0 +1,165 @@
+import logging
+from pathlib import Path
+
+import lda
+import numpy as np
+
+
+logger = logging.getLogger("lda")
+
+
+def fit(
+    model, X, vocabulary, titles, checkpoint=None, every=50, tolerance=0, window=5
+):
+    """Fit topic model, saving the sampler state every n iterations."""
+    logging.info("Fitting topic model...")
+    random_state = lda.utils.check_random_state(model.random_state)
+    rands = model._rands.copy()
+    model._initialize(X)
+    state = {
+        "vocabulary": np.array(vocabulary, dtype=str),
+        "titles": np.array(titles, dtype=str),
+        "tolerance": tolerance,
+        "window": window,
+    }
+    return _sample(model, random_state, rands, 0, state, checkpoint, every)
+
+
+def resume(checkpoint, iterations=0, every=50, titles=None):
+    """Resume topic model from checkpoint, optionally with more iterations."""
+    logging.info("Resuming topic model from checkpoint...")
+    model, random_state, rands, iteration, state = load_checkpoint(checkpoint)
+    if titles is not None and sorted(state["titles"]) != sorted(titles):
+        raise ValueError("The checkpoint belongs to another topic model.")
+    model.n_iter += int(iterations)
+    if iterations:
+        # Extending a model asks for exactly this many more iterations:
+        state["tolerance"] = 0
+    _sample(model, random_state, rands, iteration, state, checkpoint, every)
+    return model, list(state["vocabulary"]), list(state["titles"])
+
+
+def save_checkpoint(path, model, random_state, rands, iteration, state):
+    """Write the sampler state to disk."""
+    logging.info("Saving checkpoint at iteration {}...".format(iteration))
+    path = Path(path)
+    algorithm, keys, position, has_gauss, cached_gaussian = random_state.get_state()
+    tmp = path.with_name("{}.tmp".format(path.name))
+    with tmp.open("wb") as file:
+        np.savez(
+            file,
+            iteration=iteration,
+            n_topics=model.n_topics,
+            n_iter=model.n_iter,
+            alpha=model.alpha,
+            eta=model.eta,
+            seed=-1 if model.random_state is None else model.random_state,
+            refresh=model.refresh,
+            nzw=model.nzw_,
+            ndz=model.ndz_,
+            nz=model.nz_,
+            WS=model.WS,
+            DS=model.DS,
+            ZS=model.ZS,
+            loglikelihoods=np.array(model.loglikelihoods_),
+            rands=rands,
+            rng_algorithm=algorithm,
+            rng_keys=keys,
+            rng_position=position,
+            rng_has_gauss=has_gauss,
+            rng_cached_gaussian=cached_gaussian,
+            **state
+        )
+    # Replacing is atomic, a crash while writing keeps the last checkpoint:
+    tmp.replace(path)
+
+
+def load_checkpoint(path):
+    """Restore the sampler state from disk."""
+    logging.info("Loading checkpoint...")
+    with np.load(str(path)) as checkpoint:
+        seed = int(checkpoint["seed"])
+        model = lda.LDA(
+            n_topics=int(checkpoint["n_topics"]),
+            n_iter=int(checkpoint["n_iter"]),
+            alpha=float(checkpoint["alpha"]),
+            eta=float(checkpoint["eta"]),
+            random_state=None if seed < 0 else seed,
+            refresh=int(checkpoint["refresh"]),
+        )
+        model.nzw_ = np.asfortranarray(checkpoint["nzw"])
+        model.ndz_ = np.ascontiguousarray(checkpoint["ndz"])
+        model.nz_ = checkpoint["nz"]
+        model.WS = checkpoint["WS"]
+        model.DS = checkpoint["DS"]
+        model.ZS = checkpoint["ZS"]
+        model.loglikelihoods_ = checkpoint["loglikelihoods"].tolist()
+        random_state = np.random.RandomState()
+        random_state.set_state(
+            (
+                str(checkpoint["rng_algorithm"]),
+                checkpoint["rng_keys"],
+                int(checkpoint["rng_position"]),
+                int(checkpoint["rng_has_gauss"]),
+                float(checkpoint["rng_cached_gaussian"]),
+            )
+        )
+        rands = checkpoint["rands"]
+        iteration = int(checkpoint["iteration"])
+        state = {
+            "vocabulary": checkpoint["vocabulary"],
+            "titles": checkpoint["titles"],
+            "tolerance": float(checkpoint["tolerance"]),
+            "window": int(checkpoint["window"]),
+        }
+    return model, random_state, rands, iteration, state
+
+
+def load_tokens(path):
+    """Load document and word of every token from a checkpoint."""
+    with np.load(str(path)) as checkpoint:
+        return checkpoint["DS"], checkpoint["WS"]
+
+
+def converged(loglikelihoods, tolerance, window=5):
+    """Check if the log-likelihood stopped improving."""
+    if not tolerance or len(loglikelihoods) <= window:
+        return False
+    before, now = loglikelihoods[-window - 1], loglikelihoods[-1]
+    return (now - before) / abs(before) < tolerance
+
+
+def _sample(model, random_state, rands, start, state, checkpoint, every):
+    # This mirrors lda.LDA._fit(), but can start at any iteration:
+    model.converged_ = None
+    for it in range(start, model.n_iter):
+        random_state.shuffle(rands)
+        if it % model.refresh == 0:
+            ll = model.loglikelihood()
+            logger.info("<{}> log likelihood: {:.0f}".format(it, ll))
+            model.loglikelihoods_.append(ll)
+            if converged(model.loglikelihoods_, state["tolerance"], state["window"]):
+                model.converged_ = it
+        model._sample_topics(rands)
+        if model.converged_ is not None:
+            logging.info(
+                "Log-likelihood converged after {} iterations.".format(it + 1)
+            )
+            model.n_iter = it + 1
+            break
+        if checkpoint and (it + 1) % every == 0 and it + 1 < model.n_iter:
+            save_checkpoint(checkpoint, model, random_state, rands, it + 1, state)
+    ll = model.loglikelihood()
+    logger.info("<{}> log likelihood: {:.0f}".format(model.n_iter - 1, ll))
+    if checkpoint:
+        # The final state allows to extend a finished model later:
+        save_checkpoint(checkpoint, model, random_state, rands, model.n_iter, state)
+    model.components_ = (model.nzw_ + model.eta).astype(float)
+    model.components_ /= np.sum(model.components_, axis=1)[:, np.newaxis]
+    model.topic_word_ = model.components_
+    model.doc_topic_ = (model.ndz_ + model.alpha).astype(float)
+    model.doc_topic_ /= np.sum(model.doc_topic_, axis=1)[:, np.newaxis]
+    del model.WS
+    del model.DS
+    del model.ZS
+    return model
@@ -0,0 +1,330 @@
+import json
+import logging
+import multiprocessing
+import os
+from pathlib import Path
+import shutil
+import sqlite3
+import threading
+import time
+
+import flask
+
+from topicsexplorer import utils
+
+
+JOBS = Path(utils.TEMPDIR, "topicsexplorer-jobs.db")
+# At most one topic model per core is fitted at the same time:
+MAX_JOBS = int(os.environ.get("TOPICSEXPLORER_MAX_JOBS", os.cpu_count() or 1))
+# A job is only started if at least this much memory (in bytes) is left:
+MIN_MEMORY = int(os.environ.get("TOPICSEXPLORER_MIN_MEMORY", 512 * 1024 ** 2))
+# Estimated memory of all running jobs must not exceed this (in bytes):
+MAX_MEMORY = int(os.environ.get("TOPICSEXPLORER_MAX_MEMORY", 0)) or None
+# Workspaces not used for this many days are removed, with their jobs:
+WORKSPACE_DAYS = float(os.environ.get("TOPICSEXPLORER_WORKSPACE_DAYS", 7))
+INTERVAL = 1
+# Seconds between looking for expired workspaces:
+CLEANUP_INTERVAL = 3600
+COLUMNS = ["id", "state", "priority", "memory", "submitted", "started", "finished"]
+
+_dispatcher = None
+_lock = threading.Lock()
+
+
+def connect():
+    """Create connection to the job database shared by all processes."""
+    db = sqlite3.connect(str(JOBS), timeout=30, isolation_level=None)
+    db.execute(
+        "CREATE TABLE IF NOT EXISTS jobs ("
+        "id INTEGER PRIMARY KEY, workspace TEXT, target TEXT, arguments TEXT, "
+        "state TEXT, priority INTEGER, memory INTEGER, pid INTEGER, "
+        "submitted REAL, started REAL, finished REAL);"
+    )
+    return db
+
+
+def submit(workspace, target, arguments, memory=0, priority=0):
+    """Queue a workflow function to run in a separate process."""
+    logging.info("Queueing topic modeling job...")
+    logging.info("Estimated memory: {:.0f} MiB".format(memory / 1024 ** 2))
+    db = connect()
+    try:
+        db.execute("BEGIN IMMEDIATE;")
+        # Jobs of a workspace would share its database and log, one at a time:
+        if _is_active(db, workspace):
+            db.execute("ROLLBACK;")
+            logging.info("A topic model is already being created.")
+            return None
+        job = db.execute(
+            "INSERT INTO jobs (workspace, target, arguments, state, priority, "
+            "memory, submitted) VALUES(?, ?, ?, 'queued', ?, ?, ?);",
+            [
+                str(workspace),
+                target,
+                json.dumps(arguments),
+                int(priority),
+                int(memory),
+                time.time(),
+            ],
+        ).lastrowid
+        db.execute("COMMIT;")
+    finally:
+        db.close()
+    start()
+    dispatch()
+    return job
+
+
+def is_active(workspace):
+    """Whether a job of the workspace is queued or running."""
+    db = connect()
+    try:
+        return _is_active(db, workspace)
+    finally:
+        db.close()
+
+
+def get_job(workspace):
+    """Get the latest job of a workspace, with its position in the queue."""
+    db = connect()
+    try:
+        job = db.execute(
+            "SELECT {} FROM jobs WHERE workspace = ? "
+            "ORDER BY id DESC LIMIT 1;".format(", ".join(COLUMNS)),
+            [str(workspace)],
+        ).fetchone()
+        if job is None:
+            return None
+        job = dict(zip(COLUMNS, job))
+        job["position"] = db.execute(
+            "SELECT COUNT(*) FROM jobs WHERE state = 'queued' "
+            "AND (priority > ? OR (priority = ? AND id <= ?));",
+            [job["priority"], job["priority"], job["id"]],
+        ).fetchone()[0]
+    finally:
+        db.close()
+    return job
+
+
+def get_queue(workspace=None):
+    """Get running and queued jobs, in the order they are started."""
+    db = connect()
+    try:
+        jobs = db.execute(
+            "SELECT {}, workspace FROM jobs WHERE state IN ('running', 'queued') "
+            "ORDER BY state = 'queued', priority DESC, id;".format(", ".join(COLUMNS))
+        ).fetchall()
+    finally:
+        db.close()
+    queue = []
+    position = 0
+    for job in jobs:
+        job = dict(zip(COLUMNS + ["own"], job))
+        # Workspaces are private, only tell if it is the own one:
+        job["own"] = job["own"] == str(workspace)
+        if job["state"] == "queued":
+            position += 1
+            job["position"] = position
+        else:
+            job["position"] = 0
+        queue.append(job)
+    return queue
+
+
+def estimate_memory(parameters):
+    """Estimate the peak memory (in bytes) of fitting a topic model."""
+    import numpy as np
+
+    D = parameters["n_documents"]
+    W = parameters["n_types"]
+    K = parameters["n_topics"]
+    N = parameters.get("n_tokens", 0)
+    F = parameters.get("n_features", W)
+    # Dense document-term matrix (int64), copied once while pruning:
+    dtm = 2 * D * W * 8
+    # Sampler: word, document and topic of every token, count matrices (intc):
+    sampler = 3 * N * 4 + (K * F + D * K + K) * 4
+    # Model output (float64) and similarity matrices (e.g. float32):
+    itemsize = np.dtype(utils.get_dtype()).itemsize
+    output = (K * F + D * K) * 8 + (D * D + K * K) * itemsize
+    return int(dtm + sampler + output)
+
+
+def start():
+    """Start the dispatcher thread of this process (if not yet running)."""
+    global _dispatcher
+    with _lock:
+        if _dispatcher is None or not _dispatcher.is_alive():
+            _dispatcher = threading.Thread(target=_dispatch_forever, daemon=True)
+            _dispatcher.start()
+
+
+def dispatch():
+    """Start queued jobs, as far as cores and memory allow."""
+    # Join finished child processes, so they do not count as alive:
+    multiprocessing.active_children()
+    db = connect()
+    try:
+        # Lock the job database, other processes dispatch, too:
+        db.execute("BEGIN IMMEDIATE;")
+        _reap(db)
+        running, reserved = db.execute(
+            "SELECT COUNT(*), TOTAL(memory) FROM jobs WHERE state = 'running';"
+        ).fetchone()
+        queued = db.execute(
+            "SELECT id, workspace, target, arguments, memory FROM jobs "
+            "WHERE state = 'queued' ORDER BY priority DESC, id;"
+        ).fetchall()
+        # Jobs start in order, a large job is not overtaken by smaller ones:
+        for job_id, workspace, target, arguments, memory in queued:
+            if running >= MAX_JOBS or not _admit(memory, running, reserved):
+                break
+            logging.info("Starting job {}...".format(job_id))
+            pid = _launch(job_id, workspace, target, json.loads(arguments))
+            db.execute(
+                "UPDATE jobs SET state = 'running', pid = ?, started = ? WHERE id = ?;",
+                [pid, time.time(), job_id],
+            )
+            running += 1
+            reserved += memory
+        db.execute("COMMIT;")
+    except Exception:
+        db.execute("ROLLBACK;")
+        raise
+    finally:
+        db.close()
+
+
+def remove_workspaces(days=None):
+    """Remove workspaces not used for some days, unless they have a job."""
+    days = WORKSPACE_DAYS if days is None else days
+    if not utils.WORKSPACES.exists():
+        return
+    deadline = time.time() - days * 24 * 60 * 60
+    db = connect()
+    try:
+        for workspace in utils.WORKSPACES.iterdir():
+            if not workspace.is_dir() or _is_active(db, workspace):
+                continue
+            # Files are written e.g. by a command-line run, the workspace is used:
+            used = max(
+                path.stat().st_mtime for path in [workspace, *workspace.iterdir()]
+            )
+            if used < deadline:
+                logging.info(
+                    "Removing expired workspace '{}'...".format(workspace.name)
+                )
+                shutil.rmtree(str(workspace), ignore_errors=True)
+                db.execute("DELETE FROM jobs WHERE workspace = ?;", [str(workspace)])
+    finally:
+        db.close()
+
+
+def get_total_memory():
+    """Physical memory in bytes, None if unknown."""
+    return _get_memory("MemTotal", "SC_PHYS_PAGES")
+
+
+def get_available_memory():
+    """Available memory in bytes, None if unknown."""
+    return _get_memory("MemAvailable", "SC_AVPHYS_PAGES")
+
+
+def _get_memory(key, name):
+    try:
+        with open("/proc/meminfo", encoding="utf-8") as meminfo:
+            for line in meminfo:
+                if line.startswith("{}:".format(key)):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    try:
+        return os.sysconf(name) * os.sysconf("SC_PAGE_SIZE")
+    except (ValueError, OSError, AttributeError):
+        return None
+
+
+def _admit(memory, running, reserved):
+    available = get_available_memory()
+    if available is not None and available < MIN_MEMORY:
+        return False
+    if not running:
+        # A job larger than the limits still runs, but on its own:
+        return True
+    limit = MAX_MEMORY or get_total_memory()
+    if limit is not None and reserved + memory > limit:
+        return False
+    return available is None or available - memory >= MIN_MEMORY
+
+
+def _launch(job_id, workspace, target, arguments):
+    process = multiprocessing.get_context("spawn").Process(
+        target=_execute, args=(job_id, workspace, target, arguments)
+    )
+    process.start()
+    return process.pid
+
+
+def _is_active(db, workspace):
+    return bool(
+        db.execute(
+            "SELECT COUNT(*) FROM jobs WHERE workspace = ? "
+            "AND state IN ('running', 'queued');",
+            [str(workspace)],
+        ).fetchone()[0]
+    )
+
+
+def _reap(db):
+    # Jobs whose process died without a word (e.g. killed) have failed:
+    for job_id, pid in db.execute(
+        "SELECT id, pid FROM jobs WHERE state = 'running';"
+    ).fetchall():
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            logging.error("ERROR: Job {} died unexpectedly.".format(job_id))
+            _finish(db, job_id, "failed")
+        except PermissionError:
+            pass
+
+
+def _finish(db, job_id, state):
+    db.execute(
+        "UPDATE jobs SET state = ?, finished = ? WHERE id = ?;",
+        [state, time.time(), job_id],
+    )
+
+
+def _dispatch_forever():
+    cleaned = 0
+    while True:
+        try:
+            dispatch()
+            if time.time() - cleaned >= CLEANUP_INTERVAL:
+                cleaned = time.time()
+                remove_workspaces()
+        except Exception as error:
+            logging.error("ERROR: {}".format(error))
+        time.sleep(INTERVAL)
+
+
+def _execute(job_id, workspace, target, arguments):
+    # Runs in the child process, which logs only into its workspace:
+    from topicsexplorer import workflow
+
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(message)s",
+        handlers=[logging.FileHandler(str(Path(workspace, utils.LOGFILE.name)))],
+        force=True,
+    )
+    app = utils.init_app("topicsexplorer")
+    with app.app_context():
+        flask.g.workspace = workspace
+        succeeded = workflow.execute(target, arguments)
+    db = connect()
+    try:
+        _finish(db, job_id, "done" if succeeded else "failed")
+    finally:
+        db.close()
@@ -0,0 +1,140 @@
+import logging
+
+import numpy as np
+
+
+# Documents are embedded relative to this many landmark documents:
+LANDMARKS = 500
+# Landmarks are drawn with a fixed seed, the map is the same every time:
+SEED = 0
+
+
+def get_topic_map(topic_similarities, topic_sizes, n_clusters=None):
+    """Embed topics in 2-D and cluster them hierarchically."""
+    logging.info("Calculating topic map...")
+    distances = 1 - np.asarray(topic_similarities, dtype=np.float64)
+    coordinates = get_embedding(distances)
+    linkage = cluster(distances)
+    n_clusters = n_clusters or get_number_of_clusters(len(distances))
+    return {
+        "x": _round(coordinates[:, 0]),
+        "y": _round(coordinates[:, 1]),
+        "size": _round(topic_sizes),
+        "cluster": get_clusters(linkage, n_clusters).tolist(),
+        "linkage": [
+            [int(a), int(b), round(float(distance), 4), int(size)]
+            for a, b, distance, size in linkage
+        ],
+    }
+
+
+def get_document_map(document_topic, landmarks=LANDMARKS, n_clusters=None):
+    """Embed documents in 2-D and cluster them, both via landmark documents."""
+    logging.info("Calculating document map...")
+    random_state = np.random.RandomState(SEED)
+    n_documents = len(document_topic)
+    landmarks = np.sort(
+        random_state.choice(n_documents, min(landmarks, n_documents), replace=False)
+    )
+    # Normalized once, cosine similarity is a dot product then:
+    vectors = np.array(document_topic, dtype=np.float32)
+    vectors /= np.maximum(np.linalg.norm(vectors, axis=1), 1e-12)[:, np.newaxis]
+    distances = np.maximum(1 - vectors @ vectors[landmarks].T, 0)
+    coordinates = get_landmark_embedding(distances, landmarks)
+    # Every document joins the cluster of its nearest landmark:
+    n_clusters = n_clusters or get_number_of_clusters(len(landmarks))
+    clusters = get_clusters(cluster(distances[landmarks]), n_clusters)
+    nearest = np.argmin(distances, axis=1)
+    return {
+        "x": _round(coordinates[:, 0]),
+        "y": _round(coordinates[:, 1]),
+        "cluster": clusters[nearest].tolist(),
+        "topic": np.argmax(document_topic, axis=1).tolist(),
+        "landmarks": landmarks.tolist(),
+    }
+
+
+def get_embedding(distances, dimensions=2):
+    """Classical multidimensional scaling of a distance matrix."""
+    return get_landmark_embedding(distances, np.arange(len(distances)), dimensions)
+
+
+def get_landmark_embedding(distances, landmarks, dimensions=2):
+    """Landmark multidimensional scaling (de Silva and Tenenbaum, 2004).
+
+    The distances are between all points (rows) and the landmarks (columns).
+    """
+    squared = np.asarray(distances, dtype=np.float64) ** 2
+    landmark_squared = squared[landmarks]
+    # Classical scaling of the landmarks:
+    n = len(landmarks)
+    centering = np.eye(n) - 1 / n
+    values, vectors = np.linalg.eigh(-0.5 * centering @ landmark_squared @ centering)
+    top = np.argsort(values)[::-1][:dimensions]
+    values = np.maximum(values[top], 1e-12)
+    vectors = vectors[:, top]
+    # Signs of eigenvectors are arbitrary, fix them for a stable map:
+    largest = vectors[np.argmax(np.abs(vectors), axis=0), np.arange(len(top))]
+    vectors *= np.where(largest < 0, -1, 1)
+    # Triangulate all points from their distances to the landmarks:
+    pseudoinverse = vectors / np.sqrt(values)
+    coordinates = -0.5 * (squared - landmark_squared.mean(axis=0)) @ pseudoinverse
+    if coordinates.shape[1] < dimensions:
+        padding = np.zeros((len(coordinates), dimensions - coordinates.shape[1]))
+        coordinates = np.hstack([coordinates, padding])
+    return coordinates
+
+
+def cluster(distances):
+    """Agglomerative clustering with average linkage.
+
+    Returns a linkage matrix like scipy.cluster.hierarchy.linkage(): the two
+    merged clusters, their distance and the size of the new cluster.
+    """
+    n = len(distances)
+    distances = np.array(distances, dtype=np.float64)
+    np.fill_diagonal(distances, np.inf)
+    sizes = np.ones(n)
+    ids = np.arange(n)
+    linkage = np.zeros((max(n - 1, 0), 4))
+    for step in range(n - 1):
+        i, j = np.unravel_index(np.argmin(distances), distances.shape)
+        i, j = min(i, j), max(i, j)
+        size = sizes[i] + sizes[j]
+        linkage[step] = min(ids[i], ids[j]), max(ids[i], ids[j]), distances[i, j], size
+        # Lance-Williams update, the new cluster takes the place of i:
+        merged = (sizes[i] * distances[i] + sizes[j] * distances[j]) / size
+        distances[i, :] = distances[:, i] = merged
+        distances[j, :] = distances[:, j] = np.inf
+        distances[i, i] = np.inf
+        sizes[i] = size
+        ids[i] = n + step
+    return linkage
+
+
+def get_clusters(linkage, n_clusters):
+    """Cut a hierarchical clustering into flat clusters."""
+    n = len(linkage) + 1
+    n_clusters = min(max(n_clusters, 1), n)
+    parents = np.arange(2 * n - 1)
+    for step, (a, b, _, _) in enumerate(linkage[: n - n_clusters]):
+        parents[int(a)] = parents[int(b)] = n + step
+    # Climb up from every point to the root of its cluster:
+    roots = np.arange(n)
+    while True:
+        climbed = parents[roots]
+        if (climbed == roots).all():
+            break
+        roots = climbed
+    _, clusters = np.unique(roots, return_inverse=True)
+    return clusters
+
+
+def get_number_of_clusters(n):
+    """Default number of clusters for n points."""
+    return max(int(round(np.sqrt(n))), 1)
+
+
+def _round(values, decimals=4):
+    # Coordinates are for display, four decimals keep the JSON compact:
+    return np.round(np.asarray(values, dtype=np.float64), decimals).tolist()
@@ -1,16 +1,22 @@
+import codecs
+import collections
+import contextlib
+import csv
 from datetime import datetime
+from html.parser import HTMLParser
 import json
 import logging
+import os
 from pathlib import Path
 import shutil
 import sys
 import tempfile
+import threading
 from xml.etree import ElementTree
+from xml.parsers import expat
 
-import cophi
 import flask
-import numpy as np
-import pandas as pd
+from werkzeug.datastructures import FileStorage
 from werkzeug.utils import secure_filename
 
 from topicsexplorer import database
@@ -20,6 +26,15 @@ TEMPDIR = tempfile.gettempdir()
 DATABASE = Path(TEMPDIR, "topicsexplorer.db")
 LOGFILE = Path(TEMPDIR, "topicsexplorer.log")
 DATA_EXPORT = Path(TEMPDIR, "topicsexplorer-data")
+CHECKPOINT = Path(TEMPDIR, "topicsexplorer-checkpoint.npz")
+WORKSPACES = Path(TEMPDIR, "topicsexplorer-workspaces")
+# Serve this read-only model bundle, instead of the database:
+BUNDLE = os.environ.get("TOPICSEXPLORER_BUNDLE") or None
+CHUNK_SIZE = 2 ** 16
+PAGE_SIZE = 10000
+TOPIC_WORDS = 1000
+# Distributions and similarities are stored with this precision:
+DTYPE = "float32"
 
 
 def init_app(name):
@@ -31,6 +46,9 @@ def init_app(name):
         template_folder=str(Path(root, "templates")),
         static_folder=str(Path(root, "static")),
     )
+    # Sessions identify the workspace of a user, several app processes
+    # (e.g. Gunicorn workers) have to share the secret key:
+    app.secret_key = os.environ.get("TOPICSEXPLORER_SECRET_KEY") or os.urandom(24)
     return app
 
 
@@ -48,6 +66,56 @@ def init_logging(level):
         logging.getLogger("werkzeug").setLevel(logging.ERROR)
 
 
+def get_workspace(name):
+    """Get the directory of a workspace, create it if necessary."""
+    workspace = Path(WORKSPACES, secure_filename(name))
+    workspace.mkdir(parents=True, exist_ok=True)
+    # Last used now, workspaces unused for long are removed:
+    workspace.touch()
+    return workspace
+
+
+def get_path(path):
+    """Get a file of the current workspace, or the default one."""
+    if flask.has_app_context():
+        # Files given explicitly, e.g. on the command-line, come first:
+        if path in flask.g.get("paths", {}):
+            return Path(flask.g.paths[path])
+        if "workspace" in flask.g:
+            return Path(flask.g.workspace, path.name)
+    return path
+
+
+def get_dtype():
+    """Get the dtype of stored distributions and similarities."""
+    if flask.has_app_context():
+        return flask.g.get("dtype", DTYPE)
+    return DTYPE
+
+
+def get_bundle():
+    """Get the directory of the model bundle being served, if any."""
+    if flask.has_app_context():
+        return flask.g.get("bundle", BUNDLE)
+    return BUNDLE
+
+
+@contextlib.contextmanager
+def logfile(path):
+    """Additionally log into file, what the current thread logs."""
+    handler = logging.FileHandler(str(path), encoding="utf-8")
+    handler.setFormatter(logging.Formatter("%(message)s"))
+    # Other sessions are served by other threads, their records stay out:
+    thread = threading.get_ident()
+    handler.addFilter(lambda record: record.thread == thread)
+    logging.getLogger().addHandler(handler)
+    try:
+        yield
+    finally:
+        logging.getLogger().removeHandler(handler)
+        handler.close()
+
+
 def init_db(app):
     """Initialize SQLite database."""
     logging.debug("Initializing database...")
@@ -86,31 +154,255 @@ def format_logging(message):
         return message
 
 
-def load_textfile(textfile):
+def load_textfile(textfile, include=(), exclude=()):
     """Load text file, return title and content."""
-    filename = Path(secure_filename(textfile.filename))
-    title = filename.stem
-    suffix = filename.suffix
+    title = get_title(textfile.filename)
+    suffix = Path(secure_filename(textfile.filename)).suffix
     if suffix in {".txt", ".xml", ".html"}:
-        content = textfile.read().decode("utf-8")
         if suffix in {".xml", ".html"}:
-            content = remove_markup(content)
+            # Stream the file in chunks instead of reading it at once:
+            chunks = iter(lambda: textfile.read(CHUNK_SIZE), b"")
+            markup = suffix[1:]
+            content = "".join(iter_text(chunks, markup, include, exclude))
+        else:
+            content = textfile.read().decode("utf-8")
         return title, content
     # If suffix not allowed, ignore file:
     else:
         return None, None
 
 
-def remove_markup(text):
-    """Parse XML and drop tags."""
+def load_path(path, include=(), exclude=()):
+    """Load text file from disk, return title and content."""
+    path = Path(path)
+    with path.open("rb") as stream:
+        return load_textfile(FileStorage(stream, filename=path.name), include, exclude)
+
+
+def get_title(filename):
+    """Get the title of a document from its filename."""
+    return Path(secure_filename(filename)).stem
+
+
+def save_uploads(files, directory):
+    """Save uploaded files into a directory, return their paths."""
+    directory.mkdir(parents=True, exist_ok=True)
+    unlink_content(directory)
+    paths = []
+    for file in files:
+        path = Path(directory, secure_filename(file.filename))
+        file.save(str(path))
+        paths.append(str(path))
+    return paths
+
+
+def get_metadata(titles, path=None, fields=(), separator="_", filenames=None):
+    """Get metadata of documents from their filenames and a CSV file.
+
+    Yields title, field name and value. Filenames are split at the separator
+    and the parts named by fields in order, a field named - is skipped. A
+    field has one value per document, the CSV file wins over filenames.
+    Original filenames are mapped by title, titles are sanitized.
+    """
+    titles = list(titles)
+    filenames = filenames or {}
+    metadata = {}
+    if fields:
+        logging.info("Parsing metadata from filenames...")
+        for title in titles:
+            stem = Path(filenames[title]).stem if title in filenames else title
+            for name, value in zip(fields, stem.split(separator)):
+                if name != "-" and value:
+                    metadata.setdefault((title, name), value)
+    if path:
+        loaded = set()
+        for title, name, value in load_metadata(path, titles):
+            if (title, name) not in loaded:
+                metadata[title, name] = value
+                loaded.add((title, name))
+    for (title, name), value in metadata.items():
+        yield title, name, value
+
+
+def load_metadata(path, titles):
+    """Load metadata from CSV file, with a row per file."""
+    logging.info("Loading metadata from CSV file...")
+    titles = set(titles)
+    with Path(path).open("r", encoding="utf-8-sig", newline="") as file:
+        reader = csv.DictReader(file)
+        # Files are identified by a filename column, or else the first one:
+        key = "filename" if "filename" in reader.fieldnames else reader.fieldnames[0]
+        for row in reader:
+            # Titles are derived from filenames the same way:
+            title = get_title(row.pop(key) or "")
+            if title not in titles:
+                logging.info("Skipping metadata of unknown file '{}'.".format(title))
+                continue
+            for name, value in row.items():
+                if name and value:
+                    yield title, name, value.strip()
+
+
+def remove_markup(text, markup="xml", include=(), exclude=()):
+    """Parse XML (or HTML) and drop tags."""
+    return "".join(iter_text([text], markup, include, exclude))
+
+
+def iter_text(chunks, markup="xml", include=(), exclude=()):
+    """Stream text from markup without building a tree.
+
+    Only text within one of the `include` elements (or all text, if
+    empty) and outside of the `exclude` elements is yielded. Elements
+    are matched by their local name, e.g. `body` or `teiHeader`.
+    """
     logging.info("Removing markup...")
-    tree = ElementTree.fromstring(text)
-    plaintext = ElementTree.tostring(tree, encoding="utf8", method="text")
-    return plaintext.decode("utf-8")
+    if markup in {"html"}:
+        parser = _HTMLTextParser(include, exclude)
+        decoder = codecs.getincrementaldecoder("utf-8")()
+        for chunk in chunks:
+            if isinstance(chunk, bytes):
+                chunk = decoder.decode(chunk)
+            parser.feed(chunk)
+            yield from parser.pop()
+        parser.feed(decoder.decode(b"", final=True))
+        parser.close()
+        yield from parser.pop()
+    else:
+        parser = _XMLTextParser(include, exclude)
+        for chunk in chunks:
+            parser.feed(chunk)
+            yield from parser.pop()
+        parser.close()
+        yield from parser.pop()
+
+
+class _TextSelection:
+    def __init__(self, include, exclude):
+        self.include = set(include)
+        self.exclude = set(exclude)
+        self.included = 0
+        self.excluded = 0
+        self.open = []
+        self.text = []
+
+    def start(self, name):
+        self.open.append(name)
+        self.included += name in self.include
+        self.excluded += name in self.exclude
+
+    def end(self, name):
+        # Elements left open (allowed in HTML) are closed with their parent:
+        if name not in self.open:
+            return
+        while True:
+            closed = self.open.pop()
+            self.included -= closed in self.include
+            self.excluded -= closed in self.exclude
+            if closed == name:
+                break
+
+    def data(self, text):
+        if (self.included or not self.include) and not self.excluded:
+            self.text.append(text)
+
+    def pop(self):
+        text = self.text[:]
+        self.text.clear()
+        return text
+
+
+class _XMLTextParser(_TextSelection):
+    def __init__(self, include, exclude):
+        super().__init__(include, exclude)
+        self.parser = expat.ParserCreate(namespace_separator="}")
+        self.parser.buffer_text = True
+        if self.include or self.exclude:
+            self.parser.StartElementHandler = lambda name, _: self.start(_local(name))
+            self.parser.EndElementHandler = lambda name: self.end(_local(name))
+            self.parser.CharacterDataHandler = self.data
+        else:
+            # Without a selection, every text node is kept:
+            self.parser.CharacterDataHandler = self.text.append
+
+    def feed(self, chunk, final=False):
+        try:
+            self.parser.Parse(chunk, final)
+        except expat.ExpatError as error:
+            # Same exception as if parsed with ElementTree:
+            exception = ElementTree.ParseError(str(error))
+            exception.code = error.code
+            exception.position = error.lineno, error.offset
+            raise exception from error
+
+    def close(self):
+        self.feed(b"", final=True)
+
+
+class _HTMLTextParser(_TextSelection, HTMLParser):
+    # These elements never contain text to be read:
+    SKIP = {"script", "style", "template"}
+    # These elements have no end tag:
+    VOID = {
+        "area",
+        "base",
+        "br",
+        "col",
+        "embed",
+        "hr",
+        "img",
+        "input",
+        "link",
+        "meta",
+        "param",
+        "source",
+        "track",
+        "wbr",
+    }
+    # These elements end at the start of the next one:
+    SIBLINGS = {"dd", "dt", "li", "option", "p", "td", "th", "tr"}
+
+    def __init__(self, include, exclude):
+        # HTML tags are case-insensitive, the parser reports them lowercase:
+        include = {name.lower() for name in include}
+        exclude = {name.lower() for name in exclude} | self.SKIP
+        _TextSelection.__init__(self, include, exclude)
+        HTMLParser.__init__(self, convert_charrefs=True)
+
+    def handle_starttag(self, tag, attrs):
+        if tag in self.VOID:
+            return
+        # E.g. <li> ends an open <li>, even without an end tag:
+        if tag in self.SIBLINGS and self.open and self.open[-1] == tag:
+            self.end(tag)
+        self.start(tag)
+
+    def handle_endtag(self, tag):
+        self.end(tag)
+
+    def handle_data(self, data):
+        self.data(data)
+
+
+def _local(name):
+    return name.rsplit("}", 1)[-1]
+
+
+def get_paragraphs(text, size=PAGE_SIZE):
+    """Split text into paragraphs of at most size characters.
+
+    Yields the character offset of each paragraph, too.
+    """
+    position = 0
+    for paragraph in text.split("\n\n"):
+        for start in range(0, len(paragraph), size):
+            yield position + start, paragraph[start : start + size]
+        position += len(paragraph) + 2
 
 
 def get_documents(textfiles):
     """Get Document objects."""
+    import cophi
+
     logging.info("Processing documents...")
     for textfile in textfiles:
         title, content = textfile
@@ -119,76 +411,254 @@ def get_documents(textfiles):
 
 def get_stopwords(data, corpus):
     """Get stopwords from file or corpus."""
+    import cophi
+
     logging.info("Fetching stopwords...")
     if "stopwords" in data:
-        _, stopwords = load_textfile(data["stopwords"])
+        _, stopwords = load_path(data["stopwords"])
         stopwords = cophi.text.model.Document(stopwords).tokens
     else:
         stopwords = corpus.mfw(data["mfw"])
     return stopwords
 
 
-def get_data(corpus, topics, iterations, stopwords, mfw):
+def prune_vocabulary(
+    dtm, stopwords=(), hapax=True, min_df=1, max_df=1.0, max_features=None
+):
+    """Remove types from the document-term matrix, report each filter.
+
+    Document frequencies and the vocabulary size are absolute numbers if
+    passed as int, and ratios (of documents or types) if passed as float.
+    """
+    import numpy as np
+    import pandas as pd
+
+    logging.info("Pruning vocabulary...")
+    counts = dtm.fillna(0).values.astype("int64")
+    vocabulary = dtm.columns.values
+    D, W = counts.shape
+    frequencies = counts.sum(axis=0)
+    document_frequencies = (counts > 0).sum(axis=0)
+
+    if isinstance(min_df, float):
+        min_df = int(np.ceil(min_df * D))
+    if isinstance(max_df, float):
+        max_df = int(np.floor(max_df * D))
+    if isinstance(max_features, float):
+        max_features = int(max_features * W)
+
+    # Every filter narrows down a boolean mask over the term ids:
+    keep = np.ones(W, dtype=bool)
+    report = {}
+
+    def apply(name, mask):
+        dropped = keep & ~mask
+        report[name] = {
+            "types": int(dropped.sum()),
+            "tokens": int(frequencies[dropped].sum()),
+        }
+        keep[dropped] = False
+
+    apply("stopwords", ~np.isin(vocabulary, list(stopwords)))
+    if hapax:
+        # Same definition as cophi's Corpus.hapax:
+        apply("hapax", counts.max(axis=0) > 1)
+    apply("min_df", document_frequencies >= min_df)
+    apply("max_df", document_frequencies <= max_df)
+    if max_features is not None and keep.sum() > max_features:
+        # Keep the most frequent of the remaining types:
+        ranks = np.argsort(np.where(keep, -frequencies, 1), kind="stable")
+        mask = np.zeros(W, dtype=bool)
+        mask[ranks[:max_features]] = True
+        apply("max_features", mask)
+    for name, shrinkage in report.items():
+        logging.info(
+            "Removed {} types and {} tokens ({})...".format(
+                shrinkage["types"], shrinkage["tokens"], name
+            )
+        )
+    dtm = pd.DataFrame(counts[:, keep], index=dtm.index, columns=vocabulary[keep])
+    return dtm, report
+
+
+def get_data(
+    corpus,
+    topics,
+    iterations,
+    stopwords,
+    mfw,
+    seed,
+    tolerance,
+    min_df,
+    max_df,
+    max_features,
+    include,
+    exclude,
+    metadata,
+    fields,
+):
     """Get data from HTML forms."""
     logging.info("Processing user data...")
+    # Uploads are saved in the workspace, the workflow runs in another process:
+    workspace = flask.g.workspace
+    corpus = flask.request.files.getlist("corpus")
     data = {
-        "corpus": flask.request.files.getlist("corpus"),
+        "corpus": save_uploads(corpus, Path(workspace, "corpus")),
+        # Saved with sanitized names, metadata is parsed from the original ones:
+        "filenames": [Path(file.filename).name for file in corpus],
         "topics": int(flask.request.form["topics"]),
         "iterations": int(flask.request.form["iterations"]),
+        "tolerance": float(flask.request.form.get("tolerance", 0) or 0),
     }
     if flask.request.files.get("stopwords", None):
-        data["stopwords"] = flask.request.files["stopwords"]
+        stopwords = flask.request.files["stopwords"]
+        data["stopwords"] = save_uploads([stopwords], Path(workspace, "stopwords"))[0]
     else:
         data["mfw"] = int(flask.request.form["mfw"])
+    for name in ("include", "exclude"):
+        data[name] = parse_names(flask.request.form.get(name, ""))
+    for name in ("min_df", "max_df", "max_features"):
+        if flask.request.form.get(name, None):
+            data[name] = parse_number(flask.request.form[name])
+    if flask.request.files.get("metadata", None):
+        metadata = flask.request.files["metadata"]
+        data["metadata"] = save_uploads([metadata], Path(workspace, "metadata"))[0]
+    data["fields"] = parse_names(flask.request.form.get("fields", ""))
+    if flask.request.form.get("seed", None):
+        data["seed"] = int(flask.request.form["seed"])
+    else:
+        data["seed"] = get_seed()
     return data
 
 
-def get_topics(model, vocabulary, maximum=100):
-    """Get topics from topic model."""
-    logging.info("Fetching topics from topic model...")
-    for distribution in model.topic_word_:
-        words = list(
-            np.array(vocabulary)[np.argsort(distribution)][: -maximum - 1 : -1]
-        )
-        yield "{}, ...".format(", ".join(words[:3])), words
+def get_seed():
+    """Draw a random state, so that every run can be reproduced."""
+    import numpy as np
 
+    return int(np.random.randint(2 ** 31 - 1))
 
-def get_document_topic(model, titles, descriptors):
+
+def parse_names(value):
+    """Parse comma-separated element names."""
+    return [name.strip() for name in value.split(",") if name.strip()]
+
+
+def parse_number(value):
+    """Parse form value as absolute number or ratio.
+
+    Whole numbers without a decimal point, e.g. 5 or 1e3, are absolute,
+    everything else, e.g. 1.0 or 1e-3, is a ratio between 0 and 1.
+    """
+    number = float(value)
+    if number.is_integer() and "." not in value:
+        return int(number)
+    if not 0 <= number <= 1:
+        raise ValueError("'{}' is neither a whole number nor a ratio.".format(value))
+    return number
+
+
+def get_topic_words(model, maximum=TOPIC_WORDS):
+    """Get term ids and weights of the top words from topic model."""
+    import numpy as np
+
+    logging.info("Fetching topics from topic model...")
+    topic_word = model.topic_word_
+    maximum = min(maximum, topic_word.shape[1])
+    # Partial sort, only the top words need to be ordered:
+    words = np.argpartition(-topic_word, maximum - 1, axis=1)[:, :maximum]
+    weights = np.take_along_axis(topic_word, words, axis=1)
+    order = np.argsort(-weights, axis=1, kind="stable")
+    words = np.take_along_axis(words, order, axis=1).astype(np.int32)
+    weights = np.take_along_axis(weights, order, axis=1).astype(np.float32)
+    return words, weights
+
+
+def get_descriptors(words, vocabulary):
+    """Get unique descriptors of topics from their top words."""
+    import numpy as np
+
+    vocabulary = np.array(vocabulary)
+    descriptors = ["{}, ...".format(", ".join(vocabulary[ids[:3]])) for ids in words]
+    counts = collections.Counter(descriptors)
+    # Topics sharing their top words are told apart by their number:
+    for n, descriptor in enumerate(descriptors):
+        yield "{} ({})".format(descriptor, n) if counts[descriptor] > 1 else descriptor
+
+
+def get_document_topic(model, titles, descriptors, dtype=None):
     """Get document-topic distribution from topic model."""
+    import pandas as pd
+
     logging.info("Fetching document-topic distributions from topic model...")
-    document_topic = pd.DataFrame(model.doc_topic_)
+    document_topic = pd.DataFrame(
+        model.doc_topic_.astype(dtype or get_dtype(), copy=False)
+    )
     document_topic.index = titles
     document_topic.columns = descriptors
     return document_topic
 
 
-def get_cosine(matrix, descriptors):
+def get_cosine(matrix, descriptors, dtype=None):
     """Calculate cosine similarity between columns."""
+    import numpy as np
+    import pandas as pd
+
     logging.info("Calculcating cosine similarity...")
-    d = matrix.T @ matrix
-    norm = (matrix * matrix).sum(0, keepdims=True) ** 0.5
-    similarities = d / norm / norm.T
+    # The only copy of the matrix, normalized in place:
+    matrix = np.array(matrix, dtype=dtype or get_dtype())
+    norm = np.sqrt(np.einsum("ij,ij->j", matrix, matrix))
+    norm[norm == 0] = 1
+    matrix /= norm
+    similarities = matrix.T @ matrix
     return pd.DataFrame(similarities, index=descriptors, columns=descriptors)
 
 
+def get_precision(dtype=None, values=None):
+    """Number of decimals keeping the significant digits of a dtype.
+
+    With values, also for the smallest of them, e.g. 0.0000123.
+    """
+    import numpy as np
+
+    digits = int(np.finfo(dtype or get_dtype()).precision) + 1
+    values = np.abs(np.asarray(values if values is not None else []))
+    values = values[values > 0]
+    if values.size:
+        # Decimals are counted from the point, add the leading zeros:
+        digits += max(-int(np.floor(np.log10(values.min()))) - 1, 0)
+    # JSON encoding in pandas supports at most 15 decimals:
+    return min(digits, 15)
+
+
+def to_json(frame, orient="columns"):
+    """Serialize a matrix to JSON, with the significant digits of its dtype."""
+    precision = get_precision(str(frame.values.dtype), frame.values)
+    return frame.to_json(orient=orient, force_ascii=False, double_precision=precision)
+
+
 def scale(vector, minimum=50, maximum=100):
     """Min-max scaler for a vector."""
+    import numpy as np
+
     logging.debug("Scaling data from {} to {}...".format(minimum, maximum))
     return np.interp(vector, (vector.min(), vector.max()), (minimum, maximum))
 
 
 def export_data():
     """Export model output to ZIP archive."""
+    import pandas as pd
+
     logging.info("Creating data archive...")
-    if DATA_EXPORT.exists():
-        unlink_content(DATA_EXPORT)
+    directory = get_path(DATA_EXPORT)
+    if directory.exists():
+        unlink_content(directory)
     else:
-        DATA_EXPORT.mkdir()
+        directory.mkdir()
     model, stopwords = database.select("data_export")
     document_topic, topics, document_similarities, topic_similarities = model
 
     logging.info("Preparing document-topic distributions...")
-    document_topic = pd.read_json(document_topic, orient="index")
+    document_topic = document_topic.astype(get_dtype())
     document_topic.columns = [
         col.replace(",", "").replace(" ...", "") for col in document_topic.columns
     ]
@@ -199,7 +669,7 @@ def export_data():
     topics.columns = ["Word {}".format(n) for n in range(topics.shape[1])]
 
     logging.info("Preparing topic similarity matrix...")
-    topic_similarities = pd.read_json(topic_similarities)
+    topic_similarities = topic_similarities.astype(get_dtype())
     topic_similarities.columns = [
         col.replace(",", "").replace(" ...", "") for col in topic_similarities.columns
     ]
@@ -208,26 +678,35 @@ def export_data():
     ]
 
     logging.info("Preparing document similarity matrix...")
-    document_similarities = pd.read_json(document_similarities)
+    document_similarities = document_similarities.astype(get_dtype())
+
+    logging.info("Preparing topic diagnostics...")
+    diagnostics = pd.DataFrame(
+        database.select("diagnostics"), columns=["topic"] + database.DIAGNOSTICS
+    ).set_index("topic")
+    diagnostics.index = [
+        ix.replace(",", "").replace(" ...", "") for ix in diagnostics.index
+    ]
     data_export = {
         "document-topic-distribution": document_topic,
         "topics": topics,
         "topic-similarities": topic_similarities,
         "document-similarities": document_similarities,
+        "topic-diagnostics": diagnostics,
         "stopwords": json.loads(stopwords),
     }
 
     for name, data in data_export.items():
         if name in {"stopwords"}:
-            with Path(DATA_EXPORT, "{}.txt".format(name)).open(
+            with Path(directory, "{}.txt".format(name)).open(
                 "w", encoding="utf-8"
             ) as file:
                 for word in data:
                     file.write("{}\n".format(word))
         else:
-            path = Path(DATA_EXPORT, "{}.csv".format(name))
+            path = Path(directory, "{}.csv".format(name))
             data.to_csv(path, sep=";", encoding="utf-8")
-    shutil.make_archive(DATA_EXPORT, "zip", DATA_EXPORT)
+    shutil.make_archive(directory, "zip", directory)
 
 
 def unlink_content(directory, pattern="*"):
@@ -1,31 +1,57 @@
 import datetime
 import json
 import logging
-import multiprocessing
 from pathlib import Path
 import time
+import uuid
 
 import flask
-import pandas as pd
 import werkzeug
 
 from topicsexplorer import database
+from topicsexplorer import scheduler
 from topicsexplorer import utils
 from topicsexplorer import workflow
 
 
-# Initialize logging with logfile in tempdir:
-utils.init_logging(logging.INFO)
-
 # Initialize Flask application:
 web = utils.init_app("topicsexplorer")
 
 
+@web.before_first_request
+def init_logging():
+    """Initialize logging with logfile in tempdir."""
+    # Not at import time, the module is also imported by the job processes:
+    utils.init_logging(logging.INFO)
+    # The dispatcher also removes expired workspaces:
+    scheduler.start()
+
+
+@web.before_request
+def open_workspace():
+    """Every session works in a workspace of its own."""
+    if flask.request.endpoint in {"static", None}:
+        return
+    if "workspace" not in flask.session:
+        # Not for pages without a model, e.g. requested by crawlers:
+        if flask.request.endpoint in {"help", "error"}:
+            return
+        flask.session["workspace"] = uuid.uuid4().hex
+    flask.g.workspace = utils.get_workspace(flask.session["workspace"])
+    if utils.get_bundle() and flask.request.endpoint in {"modeling", "resume_modeling"}:
+        # A served model bundle is read-only:
+        flask.abort(403)
+
+
 @web.route("/")
 def index():
     """Home page."""
+    if utils.get_bundle():
+        return flask.redirect(flask.url_for("overview_topics"))
     logging.debug("Rendering home page template...")
-    utils.init_db(web)
+    if not scheduler.is_active(flask.g.workspace):
+        # Not under a job, it would lose its tables:
+        utils.init_db(web)
     return flask.render_template("index.html", help=True)
 
 
@@ -39,10 +65,13 @@ def help():
 @web.route("/error")
 def error():
     """Error page."""
-    with utils.LOGFILE.open("r", encoding="utf-8") as logfile:
+    if "workspace" not in flask.g:
+        return flask.render_template("error.html", reset=True, log="", tempdir="")
+    with utils.get_path(utils.LOGFILE).open("a+", encoding="utf-8") as logfile:
+        logfile.seek(0)
         log = logfile.read().split("\n")[-20:]
         return flask.render_template(
-            "error.html", reset=True, log="\n".join(log), tempdir=utils.TEMPDIR
+            "error.html", reset=True, log="\n".join(log), tempdir=flask.g.workspace
         )
 
 
@@ -50,10 +79,6 @@ def error():
 def modeling():
     """Modeling page."""
     logging.debug("Calling modeling page endpoint...")
-    # Must be global to use anywhere:
-    global start
-    global process
-    start = time.time()
     logging.info("Initializing topic modeling process...")
     logging.info("Started topic modeling process.")
     workflow.wrapper()
@@ -61,32 +86,22 @@ def modeling():
     return flask.render_template("modeling.html", abort=True)
 
 
+@web.route("/modeling/resume", methods=["POST"])
+def resume_modeling():
+    """Resume modeling from the last checkpoint."""
+    logging.debug("Calling resume modeling endpoint...")
+    logging.info("Resuming topic modeling process...")
+    workflow.resume_wrapper(int(flask.request.form.get("iterations", 0) or 0))
+    logging.debug("Rendering modeling page template...")
+    return flask.render_template("modeling.html", abort=True)
+
+
 @web.route("/overview-topics")
 def overview_topics():
     """Topics overview page."""
     logging.debug("Calling topics overview page endpoint...")
-    logging.info("Get document-topic distributions...")
-    response = get_document_topic_distributions()
-    document_topic = pd.read_json(response, orient="index")
-
-    logging.info("Get token frequencies...")
-    response = get_token_frequencies()
-    token_freqs = json.loads(response)
-
-    logging.info("Add frequencies to weights...")
-    document_topic = document_topic.multiply(token_freqs, axis=0)
-
-    logging.info("Sum the weights...")
-    dominance = document_topic.sum(axis=0)
-
-    logging.info("Scale weights...")
-    proportions = utils.scale(dominance)
-    proportions = pd.Series(proportions, index=dominance.index)
-    proportions = proportions.sort_values(ascending=False)
-
-    # Convert pandas.Series to a 2-D array:
-    proportions = list(utils.series2array(proportions))
-
+    logging.info("Get topic proportions...")
+    proportions = json.loads(get_aggregate("topic_proportions"))
     corpus_size = get_corpus_size()
     number_topics = get_number_of_topics()
     logging.debug("Rendering topics overview template...")
@@ -110,15 +125,8 @@ def overview_topics():
 def overview_documents():
     """Documents overview page."""
     logging.debug("Calling documents overview page endpoint...")
-    sizes = pd.DataFrame(get_textfile_sizes(), columns=["title", "size"])
-
-    proportions = utils.scale(sizes["size"])
-    proportions = pd.Series(proportions, index=sizes["title"])
-    proportions = proportions.sort_values(ascending=False)
-
-    # Convert pandas.Series to a 2-D array:
-    proportions = list(utils.series2array(proportions))
-
+    logging.info("Get document proportions...")
+    proportions = json.loads(get_aggregate("document_proportions"))
     corpus_size = get_corpus_size()
     return flask.render_template(
         "overview-documents.html",
@@ -156,16 +164,16 @@ def document_topic_distributions():
 @web.route("/topics/<topic>")
 def topics(topic):
     """Topic page."""
+    import pandas as pd
+
     logging.debug("Calling topic page endpoint...")
-    logging.info("Get topics...")
-    topics = json.loads(get_topics())
     logging.info("Get document-topic distributions...")
-    document_topic = pd.read_json(get_document_topic_distributions(), orient="index")
-    logging.info("Get topic similarity matrix...")
-    topic_similarites = pd.read_json(get_topic_similarities())
+    document_topic = pd.Series(database.select("topic_documents", topic=topic))
+    logging.info("Get topic similarities...")
+    topic_similarites = pd.Series(database.select("similar_topics", topic=topic))
 
     logging.info("Get related documents...")
-    related_docs = document_topic[topic].sort_values(ascending=False)[:10]
+    related_docs = document_topic.sort_values(ascending=False)[:10]
     related_docs_proportions = utils.scale(related_docs, minimum=70)
     related_docs_proportions = pd.Series(
         related_docs_proportions, index=related_docs.index
@@ -176,10 +184,12 @@ def topics(topic):
     related_docs_proportions = list(utils.series2array(related_docs_proportions))
 
     logging.info("Get related words...")
-    related_words = topics[topic][:15]
+    related_words = database.select("topic_words", topic=topic, n=15)
 
     logging.info("Get similar topics...")
-    similar_topics = topic_similarites[topic].sort_values(ascending=False)[1:4]
+    similar_topics = topic_similarites.sort_values(ascending=False)[1:4]
+    logging.info("Get topic diagnostics...")
+    diagnostics = database.select("topic_diagnostics", topic=topic)
     logging.debug("Rendering topic page template...")
     return flask.render_template(
         "detail-topic.html",
@@ -195,36 +205,32 @@ def topics(topic):
         similar_topics=similar_topics.index,
         related_words=related_words,
         related_documents=related_docs_proportions,
+        diagnostics=diagnostics,
     )
 
 
 @web.route("/documents/<title>")
 def documents(title):
     """Document page."""
+    import pandas as pd
+
     logging.debug("Calling document page endpoint...")
-    logging.info("Get textfiles...")
-    text = get_textfile(title)
-    logging.info("Get document-topics distributions...")
-    document_topic = pd.read_json(get_document_topic_distributions(), orient="index")
-    logging.info("Get document similarity matrix...")
-    document_similarites = pd.read_json(get_document_similarities())
+    logging.info("Get page of textfile...")
+    page = flask.request.args.get("page", 0, type=int)
+    text, pages = database.select("textfile_page", title=title, page=page)
+    logging.info("Get document-topics distribution...")
+    document_topic = pd.Series(database.select("document_topics", title=title))
+    logging.info("Get document similarities...")
+    document_similarites = pd.Series(
+        database.select("similar_documents", title=title)
+    )
 
     logging.info("Get related topics...")
-    related_topics = document_topic.loc[title].sort_values(ascending=False) * 100
+    related_topics = document_topic.sort_values(ascending=False) * 100
     distribution = list(related_topics.to_dict().items())
 
     logging.info("Get similar documents...")
-    similar_docs = document_similarites[title].sort_values(ascending=False)[1:4]
-
-    logging.debug("Use only the first 10000 characters (or less) from document...")
-    text = (
-        text
-        if len(text) < 10000
-        else "{}... This was an excerpt of the original text.".format(text[:10000])
-    )
-
-    logging.debug("Split paragraphs...")
-    text = text.split("\n\n")
+    similar_docs = document_similarites.sort_values(ascending=False)[1:4]
 
     n = get_number_of_topics()
     top_topics = [
@@ -244,6 +250,8 @@ def documents(title):
         export_data=True,
         title=title,
         text=text,
+        page=page,
+        pages=pages,
         distribution=distribution,
         similar_documents=similar_docs.index,
         related_topics=related_topics.index,
@@ -258,6 +266,8 @@ def parameters():
     logging.info("Get parameters...")
     data = json.loads(get_parameters())[0]
     info = json.loads(data)
+    logging.info("Get topic diagnostics...")
+    diagnostics = database.select("diagnostics")
     logging.debug("Rendering parameters page template...")
     return flask.render_template(
         "overview-parameters.html",
@@ -269,6 +279,7 @@ def parameters():
         documents=True,
         document_topic_distributions=True,
         export_data=True,
+        diagnostics=diagnostics,
         **info
     )
 
@@ -279,19 +290,43 @@ def parameters():
 @web.route("/api/status")
 def get_status():
     """Current modeling status."""
-    seconds = int(time.time() - start)
+    job = scheduler.get_job(flask.g.workspace)
+    if job is None:
+        # Failed before it was queued, e.g. on invalid input, the log tells:
+        with utils.get_path(utils.LOGFILE).open("a+", encoding="utf-8") as logfile:
+            logfile.seek(0)
+            messages = logfile.readlines()
+        if not messages:
+            return "No topic model is being created."
+        return utils.format_logging(messages[-1].strip())
+    seconds = int((job["finished"] or time.time()) - job["submitted"])
     elapsed_time = datetime.timedelta(seconds=seconds)
-    with utils.LOGFILE.open("r", encoding="utf-8") as logfile:
-        messages = logfile.readlines()
+    if job["state"] == "queued":
+        message = "Waiting for other topic models (position {} in queue)...".format(
+            job["position"]
+        )
+        return "Elapsed time: {}<br>{}".format(elapsed_time, message)
+    with utils.get_path(utils.LOGFILE).open("a+", encoding="utf-8") as logfile:
+        logfile.seek(0)
+        messages = logfile.readlines() or ["Starting topic modeling process..."]
         message = messages[-1].strip()
+        if job["state"] == "failed" and "Redirect to error page" not in message:
+            # The process died without logging the reason:
+            message = "ERROR: Topic modeling process died. Redirect to error page..."
         message = utils.format_logging(message)
         return "Elapsed time: {}<br>{}".format(elapsed_time, message)
 
 
+@web.route("/api/jobs")
+def get_jobs():
+    """Running and queued topic modeling jobs."""
+    return flask.jsonify(scheduler.get_queue(flask.g.workspace))
+
+
 @web.route("/api/document-topic-distributions")
 def get_document_topic_distributions():
     """Document-topics distributions."""
-    return database.select("document_topic_distributions")
+    return utils.to_json(database.select("document_topic_distributions"), orient="index")
 
 
 @web.route("/api/topics")
@@ -300,16 +335,24 @@ def get_topics():
     return database.select("topics")
 
 
+@web.route("/api/topics/<topic>")
+def get_topic_words(topic):
+    """Words of a topic with their weights."""
+    n = flask.request.args.get("n", 15, type=int)
+    words = database.select("topic_words", topic=topic, n=n)
+    return flask.jsonify(words)
+
+
 @web.route("/api/document-similarities")
 def get_document_similarities():
     """Document similarity matrix."""
-    return database.select("document_similarities")
+    return utils.to_json(database.select("document_similarities"))
 
 
 @web.route("/api/topic-similarities")
 def get_topic_similarities():
     """Topic similarity matrix."""
-    return database.select("topic_similarities")
+    return utils.to_json(database.select("topic_similarities"))
 
 
 @web.route("/api/textfiles/<title>")
@@ -318,6 +361,56 @@ def get_textfile(title):
     return database.select("textfile", title=title)
 
 
+@web.route("/api/textfiles/<title>/pages/<int:page>")
+def get_textfile_page(title, page):
+    """Page of a textfile."""
+    paragraphs, pages = database.select("textfile_page", title=title, page=page)
+    return flask.jsonify(paragraphs=paragraphs, page=page, pages=pages)
+
+
+@web.route("/api/diagnostics")
+def get_diagnostics():
+    """Coherence and other diagnostics of every topic."""
+    return flask.jsonify(database.select("diagnostics"))
+
+
+@web.route("/api/groups")
+def get_groups():
+    """Metadata fields the documents are grouped by."""
+    return flask.jsonify(database.select("group_names"))
+
+
+@web.route("/api/groups/<name>")
+def get_group(name):
+    """Topic weights summed by the values of a metadata field, e.g. a trend."""
+    group = database.select("group", name=name)
+    topic = flask.request.args.get("topic", None)
+    if topic is not None:
+        if topic not in group["topics"]:
+            flask.abort(404)
+        n = group["topics"].index(topic)
+        group["topics"] = [topic]
+        group["weights"] = [[weights[n]] for weights in group["weights"]]
+        group["proportions"] = [[shares[n]] for shares in group["proportions"]]
+    return flask.jsonify(group)
+
+
+@web.route("/api/topic-map")
+def get_topic_map():
+    """Precomputed 2-D layout and hierarchical clustering of topics."""
+    return flask.Response(
+        database.select("aggregate", name="topic_map"), mimetype="application/json"
+    )
+
+
+@web.route("/api/document-map")
+def get_document_map():
+    """Precomputed 2-D layout and clustering of documents."""
+    return flask.Response(
+        database.select("aggregate", name="document_map"), mimetype="application/json"
+    )
+
+
 @web.route("/api/stopwords")
 def get_stopwords():
     """Stopwords."""
@@ -345,13 +438,19 @@ def get_textfile_sizes():
 @web.route("/api/corpus-size")
 def get_corpus_size():
     """Corpus size."""
-    return str(len(get_textfile_sizes()))
+    return get_aggregate("corpus_size")
 
 
 @web.route("/api/number-topics")
 def get_number_of_topics():
     """Number of topics."""
-    return str(len(json.loads(get_topics())))
+    return get_aggregate("number_topics")
+
+
+@web.route("/api/aggregates/<name>")
+def get_aggregate(name):
+    """Precomputed aggregates."""
+    return database.select("aggregate", name=name)
 
 
 @web.route("/export/<filename>")
@@ -359,7 +458,7 @@ def export(filename):
     """Data archive."""
     if "topicsexplorer-data.zip" in {filename}:
         utils.export_data()
-    path = Path(utils.TEMPDIR, filename)
+    path = Path(flask.g.workspace, werkzeug.utils.secure_filename(filename))
     return flask.send_file(filename_or_fp=str(path))
 
 
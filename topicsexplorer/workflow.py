@@ -1,72 +1,166 @@
 import json
 import logging
+from pathlib import Path
 import xml
 
-import cophi
-import lda
-import numpy as np
-import pandas as pd
+import flask
 
 from topicsexplorer import database
+from topicsexplorer import scheduler
 from topicsexplorer import utils
 
 
+# Markup and whitespace included, this rather overestimates tokens:
+BYTES_PER_TOKEN = 5
+
+
 def wrapper():
     """Wrapper for the topic modeling workflow."""
-    try:
-        logging.info("Just started topic modeling workflow.")
-        data = utils.get_data("corpus", "topics", "iterations", "stopwords", "mfw")
-        if len(data["corpus"]) < 10:
-            raise ValueError(
-                "Your corpus is too small. " "Please select at least 10 text files."
+    if scheduler.is_active(flask.g.workspace):
+        # The uploads and the log belong to the job being created:
+        return
+    # The log of the workspace is also the status of the job:
+    logfile = utils.get_path(utils.LOGFILE)
+    logfile.write_text("", encoding="utf-8")
+    with utils.logfile(logfile):
+        try:
+            logging.info("Just started topic modeling workflow.")
+            data = utils.get_data(
+                "corpus",
+                "topics",
+                "iterations",
+                "stopwords",
+                "mfw",
+                "seed",
+                "tolerance",
+                "min_df",
+                "max_df",
+                "max_features",
+                "include",
+                "exclude",
+                "metadata",
+                "fields",
+            )
+            memory = scheduler.estimate_memory(estimate_parameters(data))
+            scheduler.submit(flask.g.workspace, "run", {"data": data}, memory)
+        except Exception as error:
+            _log_error(error)
+
+
+def resume_wrapper(iterations=0):
+    """Wrapper for resuming the topic modeling workflow."""
+    if scheduler.is_active(flask.g.workspace):
+        return
+    logfile = utils.get_path(utils.LOGFILE)
+    logfile.write_text("", encoding="utf-8")
+    with utils.logfile(logfile):
+        try:
+            parameters = database.select("parameters")
+            if parameters:
+                parameters = json.loads(parameters[0])
+                memory = scheduler.estimate_memory(parameters)
+            else:
+                # Crashed while preprocessing, nothing to go by:
+                memory = 0
+            # The model is already (partly) fitted, finish it first:
+            scheduler.submit(
+                flask.g.workspace,
+                "resume",
+                {"iterations": iterations},
+                memory,
+                priority=1,
             )
-        logging.info("Fetched user data...")
-        database.insert_into("textfiles", data["corpus"])
-        logging.info("Inserted data into database.")
-
-        # 1. Preprocess:
-        dtm, token_freqs, parameters = preprocess(data)
-        logging.info("Successfully preprocessed data.")
-        database.insert_into("token_freqs", json.dumps(token_freqs))
-        # 2. Create model:
-        model = create_model(dtm, data["topics"], data["iterations"])
-        parameters["log_likelihood"] = int(model.loglikelihood())
-        database.insert_into("parameters", json.dumps(parameters))
-        logging.info("Successfully created topic model.")
-        # 3. Get model output:
-        topics, descriptors, document_topic = get_model_output(model, dtm)
-        logging.info("Got model output.")
-        # 4. Calculate similarities:
-        topic_similarities, document_similarities = get_similarities(document_topic)
-        logging.info("Successfully calculated topic and document similarities.")
-
-        data = {
-            "document_topic": document_topic.to_json(orient="index", force_ascii=False),
-            "topics": json.dumps(topics, ensure_ascii=False),
-            "document_similarities": document_similarities.to_json(force_ascii=False),
-            "topic_similarities": topic_similarities.to_json(force_ascii=False),
-        }
-        database.insert_into("model", data)
-        logging.info("Successfully inserted data into database.")
-        logging.info("Very nice, great success!")
-    except xml.etree.ElementTree.ParseError as error:
+        except Exception as error:
+            _log_error(error)
+
+
+def estimate_parameters(data):
+    """Estimate corpus parameters before preprocessing, from file sizes."""
+    size = sum(Path(path).stat().st_size for path in data["corpus"])
+    N = size // BYTES_PER_TOKEN
+    # Heaps' law, fitted on English newswire (Manning et al. 2008, p. 88):
+    W = min(N, int(44 * N ** 0.49))
+    parameters = {
+        "n_documents": len(data["corpus"]),
+        "n_types": W,
+        "n_tokens": N,
+        "n_topics": int(data["topics"]),
+    }
+    max_features = data.get("max_features", None)
+    if isinstance(max_features, int):
+        parameters["n_features"] = min(W, max_features)
+    return parameters
+
+
+def execute(target, arguments):
+    """Execute a workflow function, return False if it failed."""
+    try:
+        {"run": run, "resume": resume}[target](**arguments)
+        return True
+    except Exception as error:
+        _log_error(error, resuming=target == "resume")
+        return False
+
+
+def _log_error(error, resuming=False):
+    if isinstance(error, xml.etree.ElementTree.ParseError):
         logging.error("ERROR: There is something wrong with your XML files.")
-        logging.error("ERROR: {}".format(error))
-        logging.error("Redirect to error page...")
-    except UnicodeDecodeError as error:
+    elif isinstance(error, UnicodeDecodeError):
         logging.error(
             "ERROR: There is something wrong with your text files. "
             "Are they UTF-8 encoded?"
         )
-        logging.error("ERROR: {}".format(error))
-        logging.error("Redirect to error page...")
-    except Exception as error:
-        logging.error("ERROR: {}".format(error))
-        logging.error("Redirect to error page...")
+    elif isinstance(error, FileNotFoundError) and resuming:
+        logging.error("ERROR: There is no checkpoint to resume from.")
+    logging.error("ERROR: {}".format(error))
+    logging.error("Redirect to error page...")
+
+
+def run(data):
+    """Run the topic modeling workflow on data."""
+    # The checkpoint of an earlier model must not be resumed with this data:
+    utils.get_path(utils.CHECKPOINT).unlink(missing_ok=True)
+    if len(data["corpus"]) < 10:
+        raise ValueError(
+            "Your corpus is too small. " "Please select at least 10 text files."
+        )
+    logging.info("Fetched user data...")
+    textfiles = (
+        utils.load_path(path, data["include"], data["exclude"])
+        for path in data["corpus"]
+    )
+    database.insert_into("textfiles", textfiles)
+    logging.info("Inserted data into database.")
+    titles = [title for title, _ in database.select("textfile_sizes")]
+    filenames = {
+        utils.get_title(filename): filename for filename in data.get("filenames", ())
+    }
+    metadata = utils.get_metadata(
+        titles, data.get("metadata"), data.get("fields", ()), filenames=filenames
+    )
+    database.insert_into("metadata", metadata)
+
+    # 1. Preprocess:
+    dtm, token_freqs, parameters = preprocess(data)
+    logging.info("Successfully preprocessed data.")
+    database.insert_into("token_freqs", json.dumps(token_freqs))
+    database.insert_into("parameters", json.dumps(parameters))
+    # 2. Create model:
+    model = create_model(
+        dtm, data["topics"], data["iterations"], data["seed"], data["tolerance"]
+    )
+    parameters = get_model_parameters(model, parameters)
+    database.update("parameters", json.dumps(parameters))
+    logging.info("Successfully created topic model.")
+    # 3. and 4. Get model output and similarities:
+    save_model_output(model, dtm.columns, dtm.index)
+    logging.info("Very nice, great success!")
 
 
 def preprocess(data):
     """Preprocess text data."""
+    import cophi
+
     # Constructing corpus:
     textfiles = database.select("textfiles")
     documents = utils.get_documents(textfiles)
@@ -78,41 +172,168 @@ def preprocess(data):
     N = num_tokens.sum()
     # Cleaning corpus:
     stopwords = utils.get_stopwords(data, corpus)
-    hapax = corpus.hapax
-    features = set(stopwords).union(set(hapax))
     logging.info("Cleaning corpus...")
-    dtm = corpus.drop(corpus.dtm, features)
+    dtm, pruning = utils.prune_vocabulary(
+        corpus.dtm,
+        stopwords,
+        min_df=data.get("min_df", 1),
+        max_df=data.get("max_df", 1.0),
+        max_features=data.get("max_features", None),
+    )
     # Save stopwords:
     database.insert_into("stopwords", json.dumps(stopwords))
     # Save parameters:
     parameters = {
         "n_topics": int(data["topics"]),
         "n_iterations": int(data["iterations"]),
+        "random_state": int(data["seed"]),
+        "tolerance": float(data["tolerance"]),
         "n_documents": int(D),
         "n_stopwords": int(len(stopwords)),
-        "n_hapax": int(len(hapax)),
+        "n_hapax": pruning["hapax"]["types"],
         "n_tokens": int(N),
         "n_types": int(W),
+        "n_features": int(dtm.shape[1]),
+        "pruning": pruning,
     }
     return dtm, num_tokens.tolist(), parameters
 
 
-def create_model(dtm, topics, iterations):
+def resume(iterations=0):
+    """Resume the topic modeling workflow from the last checkpoint."""
+    from topicsexplorer import sampling
+
+    logging.info("Just resumed topic modeling workflow.")
+    checkpoint = utils.get_path(utils.CHECKPOINT)
+    titles = [title for title, _ in database.select("textfile_sizes")]
+    model, vocabulary, titles = sampling.resume(checkpoint, iterations, titles=titles)
+    parameters = json.loads(database.select("parameters")[0])
+    parameters = get_model_parameters(model, parameters)
+    database.update("parameters", json.dumps(parameters))
+    logging.info("Successfully created topic model.")
+    save_model_output(model, vocabulary, titles)
+    logging.info("Very nice, great success!")
+
+
+def create_model(dtm, topics, iterations, seed=None, tolerance=0):
     """Create a topic model."""
+    import lda
+
+    from topicsexplorer import sampling
+
     logging.info("Creating topic model...")
-    model = lda.LDA(n_topics=topics, n_iter=iterations)
-    model.fit(dtm.fillna(0.0).astype("int64").values)
-    return model
+    model = lda.LDA(n_topics=topics, n_iter=iterations, random_state=seed)
+    return sampling.fit(
+        model,
+        dtm.fillna(0.0).astype("int64").values,
+        dtm.columns,
+        dtm.index,
+        checkpoint=utils.get_path(utils.CHECKPOINT),
+        tolerance=tolerance,
+    )
+
 
+def get_model_parameters(model, parameters):
+    """Add the outcome of sampling to parameters."""
+    parameters["n_iterations"] = int(model.n_iter)
+    parameters["log_likelihood"] = int(model.loglikelihood())
+    parameters["converged"] = model.converged_
+    parameters["log_likelihoods"] = [int(ll) for ll in model.loglikelihoods_]
+    return parameters
 
-def get_model_output(model, dtm):
+
+def save_model_output(model, vocabulary, titles):
+    """Get model output, calculate similarities and save both."""
+    # 3. Get model output:
+    topics, descriptors, document_topic = get_model_output(model, vocabulary, titles)
+    database.update("topics", topics)
+    logging.info("Got model output.")
+    # 4. Calculate similarities:
+    topic_similarities, document_similarities = get_similarities(document_topic)
+    logging.info("Successfully calculated topic and document similarities.")
+
+    data = {
+        "titles": document_topic.index,
+        "document_topic": document_topic.values,
+        "document_similarities": document_similarities.values,
+        "topic_similarities": topic_similarities.values,
+    }
+    database.update("model", data)
+    # 5. Aggregate output for the overview pages, and lay out the maps:
+    aggregates = get_aggregates(document_topic)
+    aggregates.update(get_maps(document_topic, topic_similarities))
+    database.update("aggregates", aggregates)
+    logging.info("Successfully inserted data into database.")
+    # 6. Sum up topics by metadata, e.g. for trends over years:
+    database.update("groups", get_groups(document_topic))
+    # 7. Diagnose topics:
+    database.update("diagnostics", get_diagnostics(model, topics["words"]))
+    logging.info("Successfully diagnosed topics.")
+
+
+def get_groups(document_topic):
+    """Sum topic weights of documents by their metadata."""
+    import numpy as np
+    import pandas as pd
+
+    logging.info("Aggregating topics by metadata...")
+    metadata = pd.DataFrame(
+        database.select("metadata"), columns=["title", "name", "value"]
+    )
+    # Topic weights are token counts, like the topic dominance:
+    token_freqs = np.array(json.loads(database.select("token_freqs")))
+    weights = document_topic.values * token_freqs[:, np.newaxis]
+    metadata["row"] = document_topic.index.get_indexer(metadata["title"])
+    metadata = metadata[metadata["row"] >= 0]
+
+    groups = []
+    for name, group in metadata.groupby("name", sort=False):
+        codes, values = pd.factorize(group["value"])
+        # Sorted by group, every group is a contiguous block of rows:
+        order = np.argsort(codes, kind="stable")
+        rows = group["row"].values[order]
+        starts = np.flatnonzero(np.diff(codes[order], prepend=-1))
+        sums = np.add.reduceat(weights[rows], starts, axis=0)
+        tokens = np.add.reduceat(token_freqs[rows], starts)
+        documents = np.diff(np.append(starts, len(rows)))
+        for n in _sort_values(values):
+            groups.append([name, values[n], documents[n], tokens[n], sums[n]])
+    return groups
+
+
+def _sort_values(values):
+    # Years and other numbers are sorted numerically:
+    try:
+        keys = [float(value) for value in values]
+    except ValueError:
+        keys = list(values)
+    return sorted(range(len(values)), key=keys.__getitem__)
+
+
+def get_diagnostics(model, words):
+    """Calculate coherence and other diagnostics of every topic."""
+    from topicsexplorer import diagnostics
+    from topicsexplorer import sampling
+
+    # The final checkpoint has the document and word of every token:
+    documents, tokens = sampling.load_tokens(utils.get_path(utils.CHECKPOINT))
+    return diagnostics.get_diagnostics(model, words, documents, tokens)
+
+
+def get_model_output(model, vocabulary, titles):
     """Get topics and distributions from topic model."""
     logging.info("Fetching model output...")
     # Topics and their descriptors:
-    topics = dict(utils.get_topics(model, dtm.columns))
-    descriptors = list(topics.keys())
+    words, weights = utils.get_topic_words(model)
+    descriptors = list(utils.get_descriptors(words, vocabulary))
+    topics = {
+        "vocabulary": vocabulary,
+        "descriptors": descriptors,
+        "words": words,
+        "weights": weights,
+    }
     # Document-topic distribution:
-    document_topic = utils.get_document_topic(model, dtm.index, descriptors)
+    document_topic = utils.get_document_topic(model, titles, descriptors)
     return topics, descriptors, document_topic
 
 
@@ -123,3 +344,55 @@ def get_similarities(document_topic):
     logging.info("Calculating document similarites...")
     documents = utils.get_cosine(document_topic.T.values, document_topic.index)
     return topics, documents
+
+
+def get_maps(document_topic, topic_similarities):
+    """Precompute the topic and document maps, with their clusters."""
+    import numpy as np
+
+    from topicsexplorer import topicmap
+
+    token_freqs = np.array(json.loads(database.select("token_freqs")))
+    dominance = token_freqs @ document_topic.values
+    topic_map = topicmap.get_topic_map(
+        topic_similarities.values, dominance / max(dominance.sum(), 1)
+    )
+    topic_map["topics"] = list(document_topic.columns)
+    document_map = topicmap.get_document_map(document_topic.values)
+    document_map["documents"] = list(document_topic.index)
+    return {
+        "topic_map": json.dumps(topic_map, ensure_ascii=False),
+        "document_map": json.dumps(document_map, ensure_ascii=False),
+    }
+
+
+def get_aggregates(document_topic):
+    """Precompute the numbers shown on the overview pages."""
+    import pandas as pd
+
+    logging.info("Aggregating model output...")
+    token_freqs = json.loads(database.select("token_freqs"))
+    sizes = dict(database.select("textfile_sizes"))
+
+    logging.info("Weight topics by token frequencies...")
+    dominance = document_topic.multiply(token_freqs, axis=0).sum(axis=0)
+    topic_proportions = pd.Series(utils.scale(dominance), index=dominance.index)
+    topic_proportions = topic_proportions.sort_values(ascending=False)
+
+    logging.info("Scale document sizes...")
+    sizes = pd.Series(sizes)
+    document_proportions = pd.Series(utils.scale(sizes), index=sizes.index)
+    document_proportions = document_proportions.sort_values(ascending=False)
+
+    aggregates = {
+        "topic_dominance": dominance.to_dict(),
+        "topic_proportions": list(utils.series2array(topic_proportions)),
+        "document_sizes": {title: int(size) for title, size in sizes.items()},
+        "document_proportions": list(utils.series2array(document_proportions)),
+        "corpus_size": int(sizes.shape[0]),
+        "number_topics": int(document_topic.shape[1]),
+    }
+    return {
+        name: json.dumps(value, ensure_ascii=False)
+        for name, value in aggregates.items()
+    }